@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the parsing of Planet 'acquired' timestamps, comparing
+psites.parse_timestamp with the datetime.strptime call it replaced.
+
+Usage: python benchmarks/bench_timestamp_parsing.py [number of timestamps]
+
+"""
+
+import os
+import sys
+import random
+import timeit
+from datetime import datetime as dt
+from datetime import timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from psites import parse_timestamp, date_format
+
+
+def make_timestamps(count, fraction=True):
+    random.seed(0)
+    text = []
+
+    for x in range(count):
+        value = dt.fromtimestamp(random.uniform(1.4e9, 1.7e9), timezone.utc)
+        text.append(value.strftime(date_format if fraction else "%Y-%m-%dT%H:%M:%SZ"))
+
+    return text
+
+
+def strptime_parse(timestamps):
+    return [dt.strptime(x, date_format).replace(tzinfo=timezone.utc) for x in timestamps]
+
+
+def fast_parse(timestamps):
+    return [parse_timestamp(x) for x in timestamps]
+
+
+if __name__ == "__main__":
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with_fraction = make_timestamps(count)
+    without_fraction = make_timestamps(count, fraction=False)
+
+    # Both approaches must agree before comparing their speed
+    assert strptime_parse(with_fraction) == fast_parse(with_fraction)
+
+    print("Parsing {} timestamps, best of 5 runs".format(count))
+    print("{:45}{:>10}".format("Method", "Seconds"))
+
+    for name, func, timestamps in [("strptime, with fractional seconds", strptime_parse, with_fraction),
+                                   ("parse_timestamp, with fractional seconds", fast_parse, with_fraction),
+                                   ("parse_timestamp, without fractional seconds", fast_parse, without_fraction)]:
+        seconds = min(timeit.repeat(lambda: func(timestamps), number=1, repeat=5))
+        print("{:45}{:>10.3f}".format(name, seconds))
@@ -23,7 +23,22 @@ import requests
 import time
 import errno
 from datetime import datetime as dt
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import hashlib
+import base64
+import copy
+import re
 import fnmatch
+import sqlite3
+import queue
+import gzip
+import shutil
+import zipfile
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 
 # Setup Planet Data API base URL
 base_url = "https://api.planet.com/data/v1"
@@ -33,6 +48,28 @@ orders_url = 'https://api.planet.com/compute/ops/orders/v2'
 subs_url = "https://api.planet.com/subscriptions/v1"
 date_format = '%Y-%m-%dT%H:%M:%S.%fZ'
 api_key = None
+download_chunk_size = 1024 * 1024    # Bytes written per iteration when streaming a download to disk
+download_workers = 4    # Default number of files downloaded concurrently
+postprocess_workers = 2    # Default number of processes converting the downloaded files
+search_workers = 4    # Default number of sites searched concurrently
+search_part_workers = 4    # Number of tiles or date ranges of a site searched concurrently
+footprint_grid = 4    # The AOI is split in a grid of N x N cells to find the parts missing from the footprint index
+order_in_flight = 4    # Default number of order chunks submitted concurrently
+order_chunk_size = 400    # Default maximum number of items per order chunk
+order_max_chunks = 80    # Number of chunks at which an order exceeds the Planet API order capacity, larger orders are split in batches
+# Rough delivery size of an item in MB, used to cap the size of order chunks
+item_type_mb = {"PSScene": 150, "REOrthoTile": 60, "REScene": 150, "SkySatScene": 300, "SkySatCollect": 1500, 
+                "SkySatVideo": 2000, "Sentinel2L1C": 800, "Landsat8L1G": 1000}
+watch_min_interval = 30    # Seconds between polls of the watch command after an order changed state
+watch_max_interval = 600    # Longest interval between polls of the watch command
+api_timeout = 60    # Seconds to wait for the server to respond before a request fails
+api_retries = 8    # Number of times a rate limited or failed request is retried
+api_pool_size = 16    # Connections kept alive by the shared HTTP client
+cache_dir = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "psites")
+cache_ttl = 6    # Hours a cached search result is reused
+cache_max_mb = 500    # Size of the search cache before the least recently used results are removed
+definitions_ttl = 24    # Hours the item type and asset type definitions are reused
+journal_filename = ".psites_journal.ndjson"    # Journal of expected file sizes and digests used by --resume
 default_item_type = ["PSScene", "REOrthoTile", "REScene", "SkySatScene", "SkySatScene", "SkySatCollect", "SkySatVideo", "Sentinel2L1C", "Landsat8L1G"]
 
 
@@ -57,9 +94,8 @@ class aoi:
                                        api_cloud_cover_min= min_cloud, 
                                        api_cloud_cover_max=max_cloud )
         self.allowed = allowed
-        self.search_results = {}
-        self.permission_tracker = []
-        self.quick_result = None
+        self.results = search_table()
+        self.features_path = None
         
         
         with open(geom_path, "r") as file:
@@ -110,14 +146,46 @@ class aoi:
     
         
         
-    def item_search(self, quick_url=quick_url, item_types=default_item_type):
+    def item_search(self, quick_url=quick_url, item_types=default_item_type, show_progress=True, cache=None, history=None, features_path=None, tiles=1, shard=None, footprints=None, part_workers=search_part_workers):
         """
         Submits an API requests to retrieve meta data for items that match the filter criteria.
+        
+        The results are processed one page at a time, only the item IDs and the counts 
+        printed by print_search are kept in memory.
 
         Parameters
         ----------
         quick_url : TYPE, optional
             DESCRIPTION. The default is quick_url. The url for searching Planet API
+        show_progress : bool, optional
+            The default is True. Print the page being processed.  Disable when several 
+            sites are searched at the same time so the output is not interleaved.
+        cache : search_cache, optional
+            The default is None. Cache of previous search results.  When the same geometry, 
+            item types and filter were searched recently the cached items are used instead 
+            of asking Planet again.
+        history : search_history, optional
+            The default is None. Results of previous searches of this site.  When given, 
+            only items published since the last search are requested and they are merged 
+            with the stored results.
+        features_path : str, optional
+            The default is None. Newline delimited JSON file where the features found are 
+            saved.
+        tiles : int, optional
+            The default is 1. Split the bounding box of the AOI in a grid of tiles x tiles 
+            cells and search the cells at the same time.  Items found in several cells 
+            are only counted once.
+        shard : str, optional
+            The default is None. Split the year range in 'year', 'quarter' or 'month'
+            periods and search the periods at the same time.
+        footprints : footprint_index, optional
+            The default is None. Local index of the items found by previous searches.  
+            Only the parts of the AOI that were not searched recently with the same 
+            criteria are searched, the items are then read from the index.  Replaces 
+            the tiles option.
+        part_workers : int, optional
+            The default is search_part_workers. Number of tiles, date ranges or cells 
+            searched at the same time.
 
         Returns
         -------
@@ -125,190 +193,391 @@ class aoi:
 
         """
         
-        print("Asking Planet for results.")
+        # Reset the search results
+        self.results = search_table()
+        self.order_chunks = None
+        self.features_path = None
         
-        # Get the API Key
-        PLANET_API_KEY = get_api_key()
+        # Files the features are written to as they are processed
+        writers = []
         
+        if features_path != None:
+            writers.append(ndjson_writer(features_path))
         
-        # Reset quick_result object
-        self.quick_result = []
-        self.id_list = []
-        self.order_chunks = None
-        self.search_results = {}
-        self.permission_tracker = []
+        if cache != None and history == None:
+            features = cache.lookup(self.aoi_feature, item_types, self.api_filter)
+            
+            if features != None:
+                self.extract_search_results(spill(features, writers))
+                self.__write_log__("Using {} items from the search cache.".format(len(self.results)))
+                self.__commit__(writers, features_path)
+                return
         
-          
-        coords = self.aoi_feature["coordinates"]      # Feature coordinates
-        api_filter = self.api_filter    # Filter to use for the search
+        api_filter = copy.deepcopy(self.api_filter)    # Filter to use for the search
+        previous = None
         
-        # Create a geometry filter component
-        geometry_filter = {"type": "GeometryFilter",
-            "field_name": "geometry",
-            "config": {
-              "type": "Polygon",
-              "coordinates": coords
-            }
-        }
+        if history != None:
+            previous = history.load(self.aoi_feature, item_types, self.api_filter)
+            
+            if previous != None and previous["high_water"] != None:
+                # Only ask for the items published since the last search
+                self.__write_log__("Searching for items published since {}.".format(previous["high_water"]))
+                api_filter["config"].append({"type": "DateRangeFilter",
+                                             "field_name": "published",
+                                             "config": {"gte": previous["high_water"]}})
+            
+            writers.append(history.writer(self.aoi_feature, item_types, self.api_filter))
+            
+        if cache != None:
+            writers.append(cache.writer(self.aoi_feature, item_types, self.api_filter))
+        
+        if show_progress:
+            print("Asking Planet for results.")
+        else:
+            self.__write_log__("Asking Planet for results.")
+        
+        self.search_failed = False
+        pages = None
+        
+        if footprints != None and history == None:
+            features = self.__footprint_search__(quick_url, item_types, footprints, shard, part_workers)
+        elif tiles > 1 or shard != None:
+            # Each item matches a single date range, but may be found in several tiles.  
+            # Tiles of the bounding box outside the AOI are not searched.
+            cells = [[]] if tiles <= 1 else [[geometry_filter(x)] for x in grid_cells(self.aoi_feature["coordinates"], tiles) 
+                                             if self.intersects({"type": "Polygon", "coordinates": x})]
+            ranges = [[]] if shard == None else [[x] for x in date_shards(self.min_year, self.max_year, shard)]
+            
+            self.__write_log__("Searching {} tiles and {} date ranges at the same time.".format(len(cells), len(ranges)))
+            
+            pages = self.__split_search__(quick_url, item_types, api_filter, [x + y for x in cells for y in ranges], part_workers)
+            features = unique_features(feature for page in pages for feature in page)
+        else:
+            pages = self.__quick_search__(quick_url, item_types, api_filter, show_progress)
+            features = (feature for page in pages for feature in page)
+        
+        try:
+            self.extract_search_results(spill(features, writers))
+        finally:
+            # Stop the searches still running if the results could not be processed, 
+            # e.g. a malformed feature or a full disk
+            features.close()
+            
+            if pages != None:
+                pages.close()
+        
+        if self.search_failed:
+            # Do not report or store the results of an incomplete search
+            for writer in writers:
+                writer.discard()
+            
+            self.results = search_table()
+            return
+        
+        if previous != None:
+            # Add the previous features that were not found again
+            new_count = len(self.results)
+            new_ids = set(self.results.ids())
+            
+            self.extract_search_results(spill((x for x in previous["features"] if x["id"] not in new_ids), writers))
+            self.__write_log__("Found {} new or updated items, {} items in total.".format(new_count, len(self.results)))
+        
+        self.__commit__(writers, features_path)
+        
+        if cache != None:
+            cache.evict()
+    
+    def __commit__(self, writers, features_path):
+        """
+        Completes the files written during a search.
+        """
+        
+        for writer in writers:
+            writer.commit()
+        
+        if features_path != None:
+            self.features_path = features_path
+            self.__write_log__("Saved {} features to {}".format(len(self.results), features_path))
+            
+    def __quick_search__(self, quick_url, item_types, api_filter, show_progress=True, geometry=None):
+        """
+        Pages through the quick search results for the AOI, yielding the features of 
+        each page as it is retrieved.  If a request fails, search_failed is set and no 
+        more pages are yielded.
+
+        Parameters
+        ----------
+        quick_url : str
+            The url for searching Planet API.
+        item_types : list
+            Item types to search.
+        api_filter : dict
+            Filter to use for the search, the geometry filter of the AOI is added to it.
+        show_progress : bool, optional
+            The default is True. Print the page being processed.
+        geometry : dict, optional
+            The default is None. Filter component selecting the area to search, instead 
+            of the GeometryFilter of the AOI.
+
+        Yields
+        ------
+        features : list
+            Features of a page of the search results.
+
+        """
+        
+        if geometry == None:
+            # Create a geometry filter component from the feature coordinates
+            geometry = geometry_filter(self.aoi_feature["coordinates"])
             
-            # Append the geometry filter component to the api_filter object
-        api_filter["config"].append(geometry_filter)
+        # Append the geometry filter component to a copy of the api_filter object
+        api_filter = copy.deepcopy(api_filter)
+        api_filter["config"].append(geometry)
         
         # Setup the request data
         request = { "filter" : api_filter, "item_types" : item_types }
     
         # Send the POST request to the API stats endpoint
-        # Setup the session to communicate with Planet's API
-        with requests.Session() as session:
-            session.auth = (PLANET_API_KEY, "")
-            res = session.post(quick_url, json=request)
+        # Searching does not change anything on the server so the POST can safely be retried
+        res = get_client().post(quick_url, json=request, idempotent=True)
         
         # Check the status code
         if(res.status_code != 200):
             self.__write_log__("Quick search  failed with code {}".format(res.status_code))
             self.__write_log__(json.dumps(res.json(), indent=2))
+            self.search_failed = True
             return
         
         response = res.json()    # retrieve API results
-        self.quick_result.extend(response["features"])      # Save API results to aoi object
+        count = len(response["features"])
         
         
         # Check if 0 results were returned, if yes, continue to the next feature
-        if(len(response["features"]) == 0):
+        if(count == 0):
             self.__write_log__("0 IDs returned in quick search.")
             return
         
-     # The API return may contain multiple pages of results.
+        yield response["features"]
+        
+        # The API return may contain multiple pages of results.
         # Retrieve each page via "_next" until the feature count is 0.
         page = 1
 
-        print("\rProcessing page {}".format(page), end="")
-        # Extract the file IDs to be downloaded and append them to id_list
-        #self.extract_search_results( response)
+        if show_progress:
+            print("\rProcessing page {}".format(page), end="")
 
-        # Get the next page.  Sleep for 5 seconds so we are not hammering the server. 
+        # Get the next page.  Rate limiting is handled by the shared client.
         next_url = response["_links"]["_next"]
+        response = None
         
         while(next_url != None):
             page = page + 1
-            time.sleep(0.1)
-            with requests.Session() as session:
-                session.auth = (PLANET_API_KEY, "")
-                res = session.get(next_url)
+            res = get_client().get(next_url)
             
-            print("\rProcessing page {}".format(page), end="")
+            if show_progress:
+                print("\rProcessing page {}".format(page), end="")
 
             # Check if API call is a success
             if(res.status_code != 200):
                 self.__write_log__("Next page retrieval failed with code {}".format(res.status_code))
                 self.__write_log__(json.dumps(res.json(), indent=2))
                 self.__write_log__("Failed to retrieve entire list of results.  Check the status code to determine if its a server issue or user issue.")
+                self.search_failed = True
                 return
             
             res_json = res.json()
+            count = count + len(res_json['features'])
+            next_url = res_json["_links"]["_next"]
             
-            # Append the results to the json file already created.
-            response['features'].extend(res_json['features'])
-            
-            self.quick_result.extend(res_json["features"])
+            # Hand the page over to be processed, only one page is held at a time
+            yield res_json['features']
 
-            next_url = res_json["_links"]["_next"]
+        if show_progress:
+            print("\n")
+        else:
+            self.__write_log__("Retrieved {} items in {} pages.".format(count, page))
+            
 
-        self.extract_search_results(response['features']) 
+    def __footprint_search__(self, quick_url, item_types, footprints, shard=None, part_workers=search_part_workers):
+        """
+        Searches the cells of a grid over the AOI that are not covered by recent searches 
+        recorded in the footprint index, adds the items found to the index, then yields 
+        the items of the index intersecting the AOI.
+        """
         
-        print("\n")
-        self.api_filter = api_filter
+        criteria = footprints.criteria(item_types, self.api_filter)
+        cells = [x for x in grid_cells(self.aoi_feature["coordinates"], footprint_grid) if self.intersects({"type": "Polygon", "coordinates": x})]
+        gaps = [x for x in cells if footprints.covers(criteria, clip_ring(self.aoi_feature["coordinates"][0], x[0])) == False]
+        ranges = [[]] if shard == None else [[x] for x in date_shards(self.min_year, self.max_year, shard)]
+        
+        if len(gaps) == 0:
+            self.__write_log__("AOI found in the footprint index.")
+            parts = []
+        elif len(gaps) == len(cells):
+            # Nothing is known about the AOI, search it as a whole
+            self.__write_log__("AOI not found in the footprint index.")
+            parts = ranges
+        else:
+            self.__write_log__("{} of {} cells of the AOI are not in the footprint index.".format(len(gaps), len(cells)))
+            parts = [[geometry_filter(x)] + y for x in gaps for y in ranges]
+        
+        if len(parts) > 1:
+            pages = self.__split_search__(quick_url, item_types, self.api_filter, parts, part_workers)
+        elif len(parts) == 1:
+            api_filter = copy.deepcopy(self.api_filter)
+            api_filter["config"].extend(parts[0])
+            pages = self.__quick_search__(quick_url, item_types, api_filter, show_progress=False)
+        else:
+            pages = (x for x in [])
+        
+        try:
+            for page in pages:
+                footprints.add(criteria, page)
+        finally:
+            pages.close()
+        
+        if self.search_failed:
+            return
+        
+        if len(gaps) > 0:
+            footprints.add_area(criteria, self.aoi_feature["coordinates"][0])
+        
+        for feature in footprints.query(criteria, ring_bounds(self.aoi_feature["coordinates"][0])):
+            if self.intersects(feature["geometry"]):
+                yield feature
+    
+    def __split_search__(self, quick_url, item_types, api_filter, parts, workers=search_part_workers):
+        """
+        Searches several parts of the AOI or of the date range at the same time, yielding 
+        the pages of all parts as they are retrieved.  Each part is a list of filter 
+        components added to api_filter, e.g. the GeometryFilter of a grid cell or the 
+        DateRangeFilter of a quarter.  Items matching several parts are returned more 
+        than once.  At most workers parts are searched at the same time.
+        """
+        
+        pages = queue.Queue(maxsize=workers * 2)
+        done = object()    # Put in the queue when the search of a part ended
+        stop = threading.Event()    # Set when the pages are no longer consumed
+        
+        def put(item):
+            # Wait for room in the queue, unless the consumer stopped
+            while stop.is_set() == False:
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
             
-
+            return False
+        
+        def search_part(part):
+            try:
+                part_filter = copy.deepcopy(api_filter)
+                part_filter["config"].extend(part)
+                
+                for page in self.__quick_search__(quick_url, item_types, part_filter, show_progress=False):
+                    if put(page) == False:
+                        break
+            finally:
+                put(done)
+        
+        get_client().ensure_pool_size(workers)
+        
+        executor = ThreadPoolExecutor(max_workers=workers)
+        jobs = [executor.submit(search_part, part) for part in parts]
+        remaining = len(jobs)
+        
+        try:
+            while remaining > 0:
+                page = pages.get()
+                
+                if page is done:
+                    remaining -= 1
+                else:
+                    yield page
+            
+            for job in jobs:
+                job.result()
+                
+        finally:
+            # When the consumer stopped early, e.g. on an error or Ctrl-C, the workers 
+            # stop after their current request instead of blocking on the full queue
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
     def extract_search_results(self, features):
         for feature in features:
-            self.id_list.append(feature["id"])
-                    
-            aq_year = str(dt.strptime(feature["properties"]["acquired"], date_format).year)
-            item_type = feature["properties"]["item_type"]
-                    
-            if aq_year not in self.search_results.keys():
-                self.search_results[aq_year] = {item_type : {"assets_tracker": {}, "item_count": 1 }}
-            elif (item_type not in self.search_results[aq_year].keys()):
-                self.search_results[aq_year][item_type] = {"assets_tracker": {}, "item_count": 1 }
-            else:
-                self.search_results[aq_year][item_type]["item_count"] = self.search_results[aq_year][item_type]["item_count"] + 1
-                        
-                    
+            self.results.append(feature)
+    
+    def intersects(self, geometry):
+        """
+        Returns True if a Polygon or MultiPolygon geometry, e.g. the footprint of an 
+        item, intersects the AOI.  Holes are ignored.
+        """
+        
+        ring = self.aoi_feature["coordinates"][0]
+        
+        return any([rings_intersect(ring, x) for x in outer_rings(geometry)])
+    
+    def item_stats(self, item_types=default_item_type, interval=None, stats_url=stats_url):
+        """
+        Asks the stats endpoint of the Data API for the number of items matching the 
+        search criteria, without retrieving the items.
 
-            for asset in feature["assets"]:
-                if asset in self.search_results[aq_year][item_type]["assets_tracker"].keys():
-                    self.search_results[aq_year][item_type]["assets_tracker"][asset]  = self.search_results[aq_year][item_type]["assets_tracker"][asset] + 1
-                else:
-                    self.search_results[aq_year][item_type]["assets_tracker"][asset]  = 1
-                            
-            for permission in feature["_permissions"]:
-                parsed_perm = permission.split(sep=".")[1].split(sep=":")[0]
-                if parsed_perm not in self.permission_tracker:
-                    self.permission_tracker.append(parsed_perm)
+        Parameters
+        ----------
+        item_types : list, optional
+            The default is default_item_type. Item types to count.
+        interval : str, optional
+            The default is None, which uses api_interval. Length of the periods counted, 
+            'hour', 'day', 'week', 'month' or 'year'.
+
+        Returns
+        -------
+        buckets : list
+            (start time, count) of each period, or None if the request failed.
+
+        """
+        
+        api_filter = copy.deepcopy(self.api_filter)
+        api_filter["config"].append(geometry_filter(self.aoi_feature["coordinates"]))
+        
+        request = {"interval": interval if interval != None else self.api_interval,
+                   "item_types": item_types,
+                   "filter": api_filter}
+        
+        # Counting does not change anything on the server so the POST can safely be retried
+        res = get_client().post(stats_url, json=request, idempotent=True)
+        
+        if(res.status_code != 200):
+            self.__write_log__("Stats request failed with code {}".format(res.status_code))
+            return None
+        
+        return [(x["start_time"], x["count"]) for x in res.json()["buckets"]]
     
     def print_search(self):   
         
-        if(self.search_results == None):
+        if(len(self.results) == 0):
             print("No search results to show.")
             
-        year_tracker = self.search_results
+        year_tracker = self.results.summary()
         
         # Summary of results
-        print("Total items found: {}\n\n".format(len(self.id_list)))
-        
-        item_type_list = []
-        asset_type_list = []
+        print("Total items found: {}\n\n".format(len(self.results)))
         
         for year in sorted(year_tracker.keys()):
             print("\nYEAR: {}".format(year))
             for item_type in sorted(year_tracker[year].keys()):
-                
-                if item_type not in item_type_list:
-                    item_type_list.append(item_type)
-                
                 print("\tTotal Items: {} \n\tItem Type: {}".format(year_tracker[year][item_type]["item_count"], item_type))
                 print("\n\t{:30}{:<6} {:5}".format("Asset Name", "Count", "% of total Items"))
                 for key in sorted(year_tracker[year][item_type]["assets_tracker"].keys()):
-                    
-                    if key not in asset_type_list:
-                        asset_type_list.append(key)
-                    
                     percent = year_tracker[year][item_type]["assets_tracker"][key] / year_tracker[year][item_type]["item_count"] 
                     
                     
                     print("\t{:30}{:<6} {:.0%}".format(key, year_tracker[year][item_type]["assets_tracker"][key], percent))
 
         if self.allowed == False:
-            print("\n\nAssets Allowed to Download: {}\n".format(self.permission_tracker))
-        
-        print("\nITEM TYPE DEFINITIONS")   
-        
-        PLANET_API_KEY = get_api_key()
-        with requests.Session() as session:
-            session.auth = (PLANET_API_KEY, "")
-            response = session.get("https://api.planet.com/data/v1/item-types")
-            
-            for x in response.json()["item_types"]:
-                
-                if x["id"] in item_type_list:
-                    print("{} \n{} \nDescription: {} \n".format(x["id"], x["display_name"], x["display_description"]))
-            
-        print("\nASSET NAME DEFINITIONS")   
-        
-        PLANET_API_KEY = get_api_key()
-        with requests.Session() as session:
-            session.auth = (PLANET_API_KEY, "")
-            response = session.get("https://api.planet.com/data/v1/asset-types")
-            
-            for x in response.json()["asset_types"]:
-                
-                if x["id"] in asset_type_list:
-                    print("{}\nDisplay Name: {} \nDescription: {} \n".format(x["id"], x["display_name"], x["display_description"]))
-
-            
-
-
+            print("\n\nAssets Allowed to Download: {}\n".format(sorted(self.results.permissions)))
         
         
 class aoi_order(aoi):
@@ -322,7 +591,17 @@ class aoi_order(aoi):
                  min_cloud=0.0, 
                  max_cloud=0.5, 
                  allowed=True, 
-                 clip=False):
+                 clip=False,
+                 cache=None,
+                 orders=None,
+                 manifest=None,
+                 tiles=1,
+                 shard=None,
+                 footprints=None,
+                 chunk_items=order_chunk_size,
+                 chunk_mb=None,
+                 item_mb=None,
+                 part_workers=search_part_workers):
         super().__init__(geom_path, min_year, max_year, min_cloud, max_cloud, allowed)
         
         
@@ -330,19 +609,41 @@ class aoi_order(aoi):
         self.bundle = bundle
         self.prefix = prefix + "_" if prefix != None else ""
         self.clip = clip
+        self.item_mb = item_mb if item_mb != None else item_type_mb.get(item_type, 100)
+        self.chunk_items = chunk_items
+        
+        if chunk_mb != None:
+            # Fewer items per chunk, to keep the delivery of each chunk under chunk_mb
+            self.chunk_items = max(1, min(chunk_items, int(chunk_mb // self.item_mb)))
         
-        current_orders = get_order_list()
+        if orders == None:
+            orders = order_snapshot(order_index().synced().query())
         
         self.order_name = const_order_name(self.prefix, self.site_name, self.min_year, self.max_year)
         
-        for order in current_orders:
-            if fnmatch.fnmatch(order["name"], self.order_name + "*") == True:
-                raise Exception("Order name '{}*' already exists on the Planet Server.  Use --order_name_prefix".format(self.order_name) +
-                                " flag to make order name unique or change the name of the geojson file.\n\n" +
-                                "Fetch the order list from Planet Server by running the following command: \n" + 
-                                "python {} check".format(os.path.basename(__file__)))
+        # Orders already placed under this name, allowed when resubmitting the same order 
+        # from a manifest
+        self.signature = self.__signature__()
+        self.existing_orders = {x["name"]: x for x in orders.named(self.order_name)}
+        self.resubmit = manifest != None and manifest.matches(self.order_name, self.item_type, self.bundle, self.signature)
         
-        self.item_search(item_types=[item_type])
+        if len(self.existing_orders) > 0 and self.resubmit == False:
+            raise Exception("Order name '{}*' already exists on the Planet Server.  Use --order_name_prefix".format(self.order_name) +
+                            " flag to make order name unique or change the name of the geojson file.\n\n" +
+                            "Fetch the order list from Planet Server by running the following command: \n" + 
+                            "python {} check".format(os.path.basename(__file__)))
+        
+        if self.resubmit == False:
+            # Check the size of the order before retrieving all the items
+            buckets = self.item_stats(item_types=[item_type])
+            
+            chunk_count = -(-sum([x[1] for x in buckets]) // self.chunk_items) if buckets != None else 0
+            
+            if chunk_count >= order_max_chunks:
+                self.__write_log__("The {} items found need {} chunks, the order will be split in batches of {} chunks.".format(
+                                   sum([x[1] for x in buckets]), chunk_count, order_max_chunks - 1))
+        
+        self.item_search(item_types=[item_type], cache=cache, tiles=tiles, shard=shard, footprints=footprints, part_workers=part_workers)
     
     def __str__(self):
         text = super().__str__()
@@ -352,98 +653,340 @@ class aoi_order(aoi):
                     "\tProduct Bundle: {}\n".format(self.bundle) +\
                     "\tOrder Name Prefix: {}\n".format(self.prefix) +\
                     "\tCheck Existing Orders: {}\n".format(self.check) +\
-                    "\tTotal Items to Download: {}\n\n".format(len(self.id_list))
+                    "\tTotal Items to Download: {}\n\n".format(len(self.results))
         
         return text + append
     
+    def __signature__(self):
+        # Hash of the search filter, AOI and clip setting, recorded in the manifest so an 
+        # order is only resubmitted with the settings it was planned with
+        text = json.dumps({"filter": self.api_filter, "geometry": self.aoi_feature, "clip": self.clip}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+    
+    
+    def place_order(self, order_url=orders_url, manifest=None, executor=None):
+        """
+        Places the order, split into chunks of at most 400 items, and prints the status of
+        each chunk.
+
+        Parameters
+        ----------
+        order_url : str, optional
+            The default is orders_url. The url of the Planet Orders API.
+        manifest : order_manifest, optional
+            The default is None. Record of the chunks submitted.  Chunks already accepted 
+            according to the manifest are not submitted again.
+        executor : concurrent.futures.Executor, optional
+            The default is None, which submits the chunks one after another.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.print_order_results(self.submit_order(order_url, manifest, executor))
+    
     
-    def place_order(self, order_url=orders_url):
+    def submit_order(self, order_url=orders_url, manifest=None, executor=None):
+        """
+        Submits the chunks of the order that were not accepted yet, without waiting for 
+        the responses.  See place_order for the parameters.
+
+        Returns
+        -------
+        results : list
+            (chunk name, future) tuples, the future returns the order ID and the status 
+            of the chunk.
+
+        """
         
         summary_text = "Preparing order for {}".format(self.site_name)
-        chunks = [self.id_list[x:x+400] for x in range(0, len(self.id_list), 400)]
-        summary_text = "{}\nNumber of chunks: {}\n".format(summary_text, len(chunks))
+        
+        if manifest != None and self.resubmit == True:
+            # Resubmission, keep the chunks and batches recorded in the manifest
+            chunks = [x["item_ids"] for x in manifest.chunks(self.order_name)]
+            batches = [x.get("batch", 0) for x in manifest.chunks(self.order_name)]
+        else:
+            chunks = self.results.chunks(self.chunk_items)
+            batches = [x // (order_max_chunks - 1) for x in range(len(chunks))]
+        
+        summary_text = "{}\nNumber of chunks: {}\nItems per chunk: {}\nEstimated size per chunk: {:.1f} GB\n".format(
+                       summary_text, len(chunks), max([len(x) for x in chunks] or [0]), max([len(x) for x in chunks] or [0]) * self.item_mb / 1000)
         self.order_chunks = chunks
-        if(len(chunks) >= 80):
+        if(len(chunks) >= order_max_chunks and manifest == None):
             self.order_chunks = None
-            raise Exception("More than 80 chunks will exceed Planet API order capacity.  Update search criteria to reduce number of results returned.")
-            
+            raise Exception("More than {} chunks will exceed Planet API order capacity.  Update search criteria to reduce number of results returned.".format(order_max_chunks))
+        
+        if manifest != None:
+            manifest.plan(self.order_name, self.item_type, self.bundle, chunks, batches, self.signature)
+        
+        # Submit the first batch having chunks that were not accepted yet
+        names = ["{}_chunk_{}".format(self.order_name, x) for x in range(len(chunks))]
+        remaining = [batch for name, batch in zip(names, batches) if name not in self.existing_orders and 
+                     (manifest == None or manifest.chunk(self.order_name, name)["status"] != "accepted")]
+        current = min(remaining) if len(remaining) > 0 else 0
+        
+        if max(batches or [0]) > 0:
+            summary_text = "{}Number of batches: {}, submitting batch {}\n".format(summary_text, max(batches) + 1, current + 1)
+        
         print(summary_text)
         
+        results = []
+        
+        for count, chunk in enumerate(self.order_chunks):
+            order_name = names[count]
+            
+            entry = manifest.chunk(self.order_name, order_name) if manifest != None else None
+            
+            if batches[count] != current and (entry == None or entry["status"] != "accepted"):
+                # Submitted by a later run of the order command
+                continue
+            
+            if entry != None and entry["status"] == "accepted":
+                results.append((order_name, completed_future((entry["order_id"], "Accepted (previously submitted)"))))
+                continue
+            
+            if order_name in self.existing_orders:
+                # Accepted by Planet but missing from the manifest, e.g. the run was interrupted
+                order_id = self.existing_orders[order_name]["id"]
+                manifest.record(self.order_name, order_name, order_id, "Accepted")
+                results.append((order_name, completed_future((order_id, "Accepted (previously submitted)"))))
+                continue
+            
+            if executor == None:
+                results.append((order_name, completed_future(self.submit_chunk(order_name, chunk, order_url, manifest))))
+            else:
+                results.append((order_name, executor.submit(self.submit_chunk, order_name, chunk, order_url, manifest)))
+        
+        return results
+    
+    
+    def submit_chunk(self, order_name, chunk, order_url=orders_url, manifest=None):
+        """
+        Submits one chunk of the order and records the result in the manifest.
+
+        Returns
+        -------
+        order_id : str
+            ID of the order, None if the order was not accepted.
+        status : str
+            "Accepted" or the reason the order failed.
+
+        """
         
         headers = {'content-type': 'application/json'}
-        PLANET_API_KEY = get_api_key()
         
+        if self.clip == False:
+            request = {  
+               "name": order_name,
+               "order_type": "partial",
+               "products":[
+                  {  
+                     "item_ids": chunk,
+                     "item_type": self.item_type,
+                      
+                     "product_bundle": self.bundle
+                  }
+               ],
+              #  "tools": [
+              #   {
+              #     "clip": {
+              #       "aoi": {
+              #         "type": "Polygon",
+              #         "coordinates": self.aoi_feature["coordinates"]
+              #       }
+              #     }
+              #   }
+              # ]
+            }
+        else:
+            request = {  
+               "name": order_name,
+               "order_type": "partial",
+               "products":[
+                  {  
+                     "item_ids": chunk,
+                     "item_type": self.item_type,
+                      
+                     "product_bundle": self.bundle
+                  }
+               ],
+                "tools": [
+                 {
+                   "clip": {
+                     "aoi": {
+                       "type": "Polygon",
+                       "coordinates": self.aoi_feature["coordinates"]
+                     }
+                   }
+                 }
+               ]
+            }
         
-        with requests.Session() as session:
-            # Authenticate
-            session.auth = (PLANET_API_KEY, "")
-            for count, chunk in enumerate(self.order_chunks):
-                order_name = "{}_chunk_{}".format(self.order_name, count)
-                
-                if self.clip == False:
-                    request = {  
-                       "name": order_name,
-                       "order_type": "partial",
-                       "products":[
-                          {  
-                             "item_ids": chunk,
-                             "item_type": self.item_type,
-                              
-                             "product_bundle": self.bundle
-                          }
-                       ],
-                      #  "tools": [
-                      #   {
-                      #     "clip": {
-                      #       "aoi": {
-                      #         "type": "Polygon",
-                      #         "coordinates": self.aoi_feature["coordinates"]
-                      #       }
-                      #     }
-                      #   }
-                      # ]
-                    }
-                else:
-                    request = {  
-                       "name": order_name,
-                       "order_type": "partial",
-                       "products":[
-                          {  
-                             "item_ids": chunk,
-                             "item_type": self.item_type,
-                              
-                             "product_bundle": self.bundle
-                          }
-                       ],
-                        "tools": [
-                         {
-                           "clip": {
-                             "aoi": {
-                               "type": "Polygon",
-                               "coordinates": self.aoi_feature["coordinates"]
-                             }
-                           }
-                         }
-                       ]
-                    }
-                
-               
-                status = None
-                order_id = None
-                
-                response = session.post(order_url, data=json.dumps(request), headers=headers)
-                
-                if(response.status_code != 202):
-                    status = "Failed: {}".format(json.dumps(response.json(), indent=2))
-                else:
-                    order_id = response.json()['id']
-                    status = "Accepted"
+       
+        status = None
+        order_id = None
+        
+        try:
+            # Placing an order is not idempotent, so it is only retried when rate limited
+            response = get_client().post(order_url, data=json.dumps(request), headers=headers)
+            
+            if(response.status_code != 202):
+                try:
+                    message = json.dumps(response.json(), indent=2)
+                except ValueError:
+                    message = response.text
+                    
+                status = "Failed: {}".format(message)
+            else:
+                order_id = response.json()['id']
+                status = "Accepted"
                 
-                print("Order Name: {} \nStatus: {} \nOrder ID: {}\n".format(order_name, status, order_id))
+        except requests.exceptions.RequestException as e:
+            status = "Failed: {}".format(e)
+        
+        if manifest != None:
+            manifest.record(self.order_name, order_name, order_id, status)
+            
+        return order_id, status
+    
+    
+    def print_order_results(self, results):
+        """
+        Waits for the chunks submitted by submit_order and prints their status.
+        """
+        
+        for order_name, future in results:
+            order_id, status = future.result()
+            print("Order Name: {} \nStatus: {} \nOrder ID: {}\n".format(order_name, status, order_id))
+            
                 
+    
+       
+class order_manifest:
+    """
+    Machine readable record of the order chunks submitted by the order command.  For 
+    each order name it keeps the item IDs of every chunk, and the order ID or the error 
+    returned when the chunk was submitted.  Running the same order command again only 
+    submits the chunks that were not accepted, with the same item IDs.
+    
+    The manifest is an append only file with one JSON object per line: the chunks of an 
+    order are written once when the order is planned, then one line is added for the 
+    result of each chunk.  Reading the file replays the lines, a later plan of the same 
+    order name replaces the earlier one.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.orders = {}
+        
+        if os.path.isfile(path):
+            with open(path, "r") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by an interrupted run
+                        continue
                     
+                    if "chunks" in entry:
+                        self.orders[entry["order"]] = entry
+                    elif entry.get("order") in self.orders:
+                        self.__update__(entry)
+    
+    def chunks(self, order_name):
+        with self.lock:
+            return self.orders[order_name]["chunks"] if order_name in self.orders else None
+    
+    def chunk(self, order_name, chunk_name):
+        for entry in self.chunks(order_name) or []:
+            if entry["name"] == chunk_name:
+                return entry
+        
+        return None
+    
+    def matches(self, order_name, item_type, bundle, signature):
+        """
+        Returns True if the order is recorded with the same item type, bundle and 
+        signature (hash of the search filter and clip setting), i.e. it can be resubmitted.
+        """
+        
+        with self.lock:
+            entry = self.orders.get(order_name)
+            
+            return entry != None and entry.get("item_type") == item_type and \
+                   entry.get("bundle") == bundle and entry.get("signature") == signature
+    
+    def plan(self, order_name, item_type, bundle, chunks, batches=None, signature=None):
+        """
+        Records the chunks of an order, unless they are already recorded with the same 
+        settings.  Chunks of a batch after the first one are recorded as 'deferred', they 
+        are submitted by later runs of the order command.
+        """
+        
+        if batches == None:
+            batches = [0] * len(chunks)
+        
+        if self.matches(order_name, item_type, bundle, signature):
+            return
+        
+        entry = {"order": order_name, 
+                 "item_type": item_type, 
+                 "bundle": bundle, 
+                 "signature": signature, 
+                 "chunks": [{"name": "{}_chunk_{}".format(order_name, count),
+                             "item_ids": chunk,
+                             "batch": batch,
+                             "status": "pending" if batch == 0 else "deferred",
+                             "order_id": None,
+                             "message": None} for count, (chunk, batch) in enumerate(zip(chunks, batches))]}
         
-           
+        with self.lock:
+            self.orders[order_name] = entry
+            self.__append__(entry)
+    
+    def record(self, order_name, chunk_name, order_id, status):
+        entry = {"order": order_name,
+                 "chunk": chunk_name,
+                 "status": "accepted" if order_id != None else "failed",
+                 "order_id": order_id,
+                 "message": status,
+                 "submitted_on": dt.now(timezone.utc).strftime(date_format)}
+        
+        with self.lock:
+            self.__update__(entry)
+            self.__append__(entry)
+    
+    def failed_count(self):
+        with self.lock:
+            return len([x for order in self.orders.values() for x in order["chunks"] if x["status"] not in ["accepted", "deferred"]])
+    
+    def deferred_count(self):
+        with self.lock:
+            return len([x for order in self.orders.values() for x in order["chunks"] if x["status"] == "deferred"])
+    
+    def __update__(self, entry):
+        for chunk in self.orders[entry["order"]]["chunks"]:
+            if chunk["name"] == entry["chunk"]:
+                chunk.update({x: entry[x] for x in ["status", "order_id", "message", "submitted_on"]})
+    
+    def __append__(self, entry):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+
+
+def completed_future(result):
+    """
+    Returns a Future already holding result.
+    """
+    
+    future = Future()
+    future.set_result(result)
+    return future
+
+
 def const_order_name(prefix, site_name, min_year, max_year):
     return "{}{}_{}_{}".format(prefix, site_name,  min_year, max_year)               
 
@@ -470,10 +1013,8 @@ def check_base_server(subs_url=subs_url):
     # Loop until authentication is successful or 'q' is hit
     while True:
         
-        # Setup test session
-        with requests.Session() as session:
-            session.auth = (PLANET_API_KEY, "")
-            res = session.get(subs_url)
+        # Test the key with the shared client
+        res = get_client().get(subs_url, auth=(PLANET_API_KEY, ""))
         
         # Check status code
         if(res.status_code == 401):
@@ -515,18 +1056,1176 @@ def get_api_key():
     
 
 
-def setup_filter(minyear, maxyear, allowed, api_cloud_cover_min=0.0, api_cloud_cover_max=0.5 ):
+class api_throttle:
     """
-    Setup a basic search filter to use with Planet API
-
-    Parameters
-    ----------
-    minyear : int
-        Starting year search.
-    maxyear : int
-        End year search, excludes the maxyear.
-    assets : list
-        Assetts to search.
+    Back off shared by every thread that talks to the Planet API.  When a request is 
+    rate limited (HTTP 429), all threads pause until the back off period has passed 
+    instead of each one retrying on its own.
+    """
+    
+    def __init__(self, base_delay=1.0, max_delay=60.0):
+        self.lock = threading.Lock()
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pause_until = 0
+        self.failures = 0
+    
+    def wait(self):
+        while True:
+            with self.lock:
+                delay = self.pause_until - time.monotonic()
+            
+            if delay <= 0:
+                return
+            
+            time.sleep(delay)
+    
+    def backoff(self, response):
+        with self.lock:
+            self.failures += 1
+            
+            # Honor the server's Retry-After header, otherwise back off exponentially with jitter
+            delay = retry_after_seconds(response)
+            if delay == None:
+                delay = backoff_delay(self.failures - 1, self.base_delay, self.max_delay)
+            
+            self.pause_until = max(self.pause_until, time.monotonic() + delay)
+    
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+
+
+def retry_after_seconds(response):
+    """
+    Returns the number of seconds requested by the Retry-After header of the response, 
+    or None if the header is missing or malformed.
+    """
+    
+    value = response.headers.get("Retry-After")
+    
+    if value == None:
+        return None
+    
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - dt.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class planet_client:
+    """
+    Process wide HTTP client used by every command to talk to the Planet APIs and to 
+    download order files.  A single requests.Session keeps connections alive between 
+    calls, and failed requests are retried:
+        
+        * HTTP 429 responses are retried after a back off shared by all threads, honoring 
+          the Retry-After header when the server sends one.
+        * HTTP 5xx responses and connection errors are retried with exponential back off 
+          and jitter, for idempotent requests only.
+    """
+    
+    def __init__(self, timeout=api_timeout, max_retries=api_retries, pool_size=api_pool_size):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = 0
+        self.lock = threading.Lock()
+        self.throttle = api_throttle()
+        self.session = requests.Session()
+        self.ensure_pool_size(pool_size)
+        
+    def ensure_pool_size(self, pool_size):
+        """
+        Grows the connection pool so that pool_size threads can each keep a connection alive.
+        """
+        
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.pool_size = pool_size
+    
+    def request(self, method, url, authenticate=True, idempotent=None, **kwargs):
+        """
+        Sends a request, retrying it when it is rate limited or fails on the server side.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method, e.g. "get" or "post".
+        url : str
+            URL of the request.
+        authenticate : bool, optional
+            The default is True. Send the Planet API key.  Disable for the signed 
+            delivery locations of order files.
+        idempotent : bool, optional
+            The default is None, which treats GET and HEAD requests as idempotent.  Only
+            idempotent requests are retried after a server error or a connection failure.
+        **kwargs : 
+            Passed to requests.Session.request.
+
+        Returns
+        -------
+        res : requests.Response
+            Response of the last attempt.
+
+        """
+        
+        if authenticate == True and "auth" not in kwargs:
+            kwargs["auth"] = (get_api_key(), "")
+        
+        if idempotent == None:
+            idempotent = method.lower() in ["get", "head"]
+        
+        kwargs.setdefault("timeout", self.timeout)
+        
+        for attempt in range(self.max_retries + 1):
+            self.throttle.wait()
+            
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if idempotent == False or attempt == self.max_retries:
+                    raise
+                
+                time.sleep(backoff_delay(attempt))
+                continue
+            
+            if res.status_code == 429:
+                self.throttle.backoff(res)
+                
+            elif res.status_code >= 500 and idempotent == True:
+                delay = retry_after_seconds(res)
+                time.sleep(delay if delay != None else backoff_delay(attempt))
+                
+            else:
+                self.throttle.success()
+                return res
+            
+            if attempt < self.max_retries:
+                res.close()
+        
+        return res
+    
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process wide planet_client, creating it on first use.
+    """
+    
+    global client
+    
+    with client_lock:
+        if client == None:
+            client = planet_client()
+    
+    return client
+
+
+def configure_client(timeout=api_timeout, max_retries=api_retries):
+    """
+    Sets the timeout and number of retries used by the process wide planet_client.
+    """
+    
+    get_client()
+    client.timeout = timeout
+    client.max_retries = max_retries
+
+
+definitions = {}    # Item type and asset type definitions retrieved by this process
+definitions_lock = threading.Lock()
+
+
+def get_definitions(catalog, path=cache_dir, ttl=definitions_ttl):
+    """
+    Returns the definitions of a catalog of the Data API, 'item-types' or 'asset-types', 
+    as a dict by ID.  Each catalog is retrieved once per process and stored in the cache 
+    directory, where it is reused for ttl hours.  When path is None the catalog is 
+    neither read from nor written to disk.
+    """
+    
+    with definitions_lock:
+        if catalog in definitions:
+            return definitions[catalog]
+        
+        file_path = os.path.join(path, catalog + ".json") if path != None else None
+        
+        try:
+            if path == None or time.time() - os.path.getmtime(file_path) > ttl * 3600:
+                raise FileNotFoundError(file_path)
+            
+            with open(file_path, "r") as file:
+                entries = json.load(file)
+                
+        except (OSError, ValueError):
+            response = get_client().get("{}/{}".format(base_url, catalog))
+            
+            if(response.status_code != 200):
+                print("Failed to retrieve the {} definitions, code {}".format(catalog, response.status_code))
+                return {}
+            
+            entries = response.json()[catalog.replace("-", "_")]
+            
+            if path != None:
+                os.makedirs(path, exist_ok=True)
+                tmp_path = "{}.{}.tmp".format(file_path, threading.get_ident())
+                
+                with open(tmp_path, "w") as file:
+                    json.dump(entries, file)
+                
+                os.replace(tmp_path, file_path)
+        
+        definitions[catalog] = {x["id"]: x for x in entries}
+        
+        return definitions[catalog]
+
+
+def print_definitions(sites, path=cache_dir):
+    """
+    Prints the definitions of the item types and asset types found for all the sites.  
+    The definitions are cached in path, None disables the cache.
+    """
+    
+    item_types = set()
+    asset_types = set()
+    
+    for site in sites:
+        item_types.update(site.results.item_types)
+        asset_types.update(site.results.assets)
+    
+    print("\nITEM TYPE DEFINITIONS")   
+    
+    for x in get_definitions("item-types", path).values():
+        
+        if x["id"] in item_types:
+            print("{} \n{} \nDescription: {} \n".format(x["id"], x["display_name"], x["display_description"]))
+        
+    print("\nASSET NAME DEFINITIONS")   
+    
+    for x in get_definitions("asset-types", path).values():
+        
+        if x["id"] in asset_types:
+            print("{}\nDisplay Name: {} \nDescription: {} \n".format(x["id"], x["display_name"], x["display_description"]))
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Returns an exponential back off delay, with jitter, for the given retry attempt.
+    """
+    
+    return min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def parse_timestamp(text):
+    """
+    Parses a timestamp returned by Planet into a UTC datetime.  Planet timestamps are 
+    ISO-8601 strings in UTC, with or without fractional seconds, e.g. 
+    2016-07-11T11:05:31.123456Z or 2016-07-11T11:05:31Z.  These are read from their 
+    fixed positions, which is several times faster than strptime, other variants are 
+    handed to datetime.fromisoformat.
+    """
+    
+    if len(text) >= 20 and text[-1] == "Z" and text[4] == "-" and text[10] == "T":
+        if text[19] == ".":
+            microsecond = int(text[20:-1][:6].ljust(6, "0"))
+        elif len(text) == 20:
+            microsecond = 0
+        else:
+            microsecond = None
+        
+        if microsecond != None:
+            return dt(int(text[0:4]), int(text[5:7]), int(text[8:10]), 
+                      int(text[11:13]), int(text[14:16]), int(text[17:19]), 
+                      microsecond, tzinfo=timezone.utc)
+    
+    value = dt.fromisoformat(text.replace("Z", "+00:00"))
+    
+    if value.tzinfo == None:
+        return value.replace(tzinfo=timezone.utc)
+    
+    return value.astimezone(timezone.utc)
+
+
+class search_table:
+    """
+    Columnar store of the items found by a search.  Item type and asset names are 
+    interned as integer codes, the IDs and acquisition timestamps are kept in arrays, 
+    and the rows having each year, item type and asset are kept as bitsets.  Counts 
+    and selections are computed by combining the bitsets instead of visiting each item.
+    """
+    
+    def __init__(self):
+        self.item_types = []    # Item type names, indexed by their code
+        self.assets = []    # Asset names, indexed by their code
+        self.item_type_codes = {}    # Code of each item type name
+        self.asset_codes = {}    # Code of each asset name
+        self.id_data = bytearray()    # Concatenated item IDs
+        self.id_ends = array("L")    # End of each ID in id_data
+        self.acquired = array("d")    # Acquisition timestamps, in seconds since the epoch
+        self.center_x = array("d")    # Center of the bounding box of each footprint
+        self.center_y = array("d")
+        self.item_type_column = array("H")    # Item type code of each row
+        self.year_bits = {}    # Rows acquired in each year
+        self.item_type_bits = []    # Rows of each item type, indexed by code
+        self.asset_bits = []    # Rows having each asset, indexed by code
+        self.permissions = set()
+    
+    def __len__(self):
+        return len(self.id_ends)
+    
+    def __intern__(self, names, codes, name):
+        code = codes.get(name)
+        
+        if code == None:
+            code = len(names)
+            codes[name] = code
+            names.append(name)
+        
+        return code
+    
+    def __set_bit__(self, bits, row):
+        index = row >> 3
+        
+        if len(bits) <= index:
+            bits.extend(bytes(index + 1 - len(bits)))
+        
+        bits[index] |= 1 << (row & 7)
+    
+    def append(self, feature):
+        row = len(self)
+        acquired = parse_timestamp(feature["properties"]["acquired"])
+        item_type = self.__intern__(self.item_types, self.item_type_codes, feature["properties"]["item_type"])
+        
+        self.id_data += feature["id"].encode()
+        self.id_ends.append(len(self.id_data))
+        self.acquired.append(acquired.timestamp())
+        self.item_type_column.append(item_type)
+        
+        bounds = [ring_bounds(x) for x in outer_rings(feature["geometry"])] if feature.get("geometry") else [(0, 0, 0, 0)]
+        self.center_x.append((min([x[0] for x in bounds]) + max([x[2] for x in bounds])) / 2)
+        self.center_y.append((min([x[1] for x in bounds]) + max([x[3] for x in bounds])) / 2)
+        
+        if item_type == len(self.item_type_bits):
+            self.item_type_bits.append(bytearray())
+        
+        self.__set_bit__(self.item_type_bits[item_type], row)
+        self.__set_bit__(self.year_bits.setdefault(acquired.year, bytearray()), row)
+        
+        for asset in feature["assets"]:
+            code = self.__intern__(self.assets, self.asset_codes, asset)
+            
+            if code == len(self.asset_bits):
+                self.asset_bits.append(bytearray())
+            
+            self.__set_bit__(self.asset_bits[code], row)
+        
+        for permission in feature["_permissions"]:
+            self.permissions.add(permission.split(sep=".")[1].split(sep=":")[0])
+    
+    def mask(self, year=None, item_type=None, asset=None):
+        """
+        Returns a bitset, as an int, of the rows matching the given year, item type and 
+        asset name.
+        """
+        
+        mask = (1 << len(self)) - 1
+        
+        if year != None:
+            mask &= int.from_bytes(self.year_bits.get(int(year), b""), "little")
+        
+        if item_type != None:
+            code = self.item_type_codes.get(item_type)
+            mask &= int.from_bytes(self.item_type_bits[code], "little") if code != None else 0
+        
+        if asset != None:
+            code = self.asset_codes.get(asset)
+            mask &= int.from_bytes(self.asset_bits[code], "little") if code != None else 0
+        
+        return mask
+    
+    def summary(self):
+        """
+        Returns the item count and the count of each asset for every year and item type, 
+        as a dict of {year: {item_type: {"item_count": int, "assets_tracker": {asset: int}}}}.
+        """
+        
+        assets = [int.from_bytes(x, "little") for x in self.asset_bits]
+        summary = {}
+        
+        for year, year_bits in self.year_bits.items():
+            year_mask = int.from_bytes(year_bits, "little")
+            
+            for code, item_type in enumerate(self.item_types):
+                group = year_mask & int.from_bytes(self.item_type_bits[code], "little")
+                
+                if group == 0:
+                    continue
+                
+                counts = [(name, (group & bits).bit_count()) for name, bits in zip(self.assets, assets)]
+                
+                summary.setdefault(str(year), {})[item_type] = {"item_count": group.bit_count(),
+                                                                "assets_tracker": {x: n for x, n in counts if n > 0}}
+        
+        return summary
+    
+    def rows(self, mask=None):
+        """
+        Returns the rows in the mask, or all rows.
+        """
+        
+        if mask == None:
+            return range(len(self))
+        
+        return [index * 8 + bit for index, byte in enumerate(mask.to_bytes((len(self) + 7) // 8, "little")) 
+                if byte != 0 for bit in range(8) if byte >> bit & 1]
+    
+    def ids(self, mask=None, rows=None):
+        """
+        Returns the IDs of the rows in the mask, or of the given rows, or of all rows.
+        """
+        
+        if rows == None:
+            rows = self.rows(mask)
+        
+        return [self.id_data[(self.id_ends[row - 1] if row > 0 else 0):self.id_ends[row]].decode() for row in rows]
+    
+    def chunks(self, size, mask=None):
+        """
+        Returns the IDs of the rows in the mask, or of all rows, split in lists of at 
+        most size IDs.  The rows are sorted by acquisition day, then by the location of 
+        their footprint along a Z-order curve, so each chunk holds items taken close in 
+        time and space, whatever the order the pages of a split search arrived in.  The 
+        chunks are balanced, their sizes differ by at most one item.
+        """
+        
+        rows = self.rows(mask)
+        
+        if len(rows) == 0:
+            return []
+        
+        bounds = (min(self.center_x), min(self.center_y), max(self.center_x), max(self.center_y))
+        rows = sorted(rows, key=lambda row: (int(self.acquired[row] // 86400), z_order(self.center_x[row], self.center_y[row], bounds)))
+        count = -(-len(rows) // size)
+        
+        return [self.ids(rows=rows[len(rows) * x // count:len(rows) * (x + 1) // count]) for x in range(count)]
+
+
+class search_cache:
+    """
+    On-disk cache of quick search results.  Each result is stored as a newline delimited 
+    JSON file named after a hash of the AOI geometry, the item types and the search filter.
+    Results older than the TTL are ignored, and the least recently used results are 
+    removed once the cache grows beyond its maximum size.
+    """
+    
+    def __init__(self, path=cache_dir, ttl=cache_ttl, max_mb=cache_max_mb):
+        self.path = os.path.join(path, "quick_search")
+        self.ttl = ttl * 3600
+        self.max_bytes = max_mb * 1e6
+        self.lock = threading.Lock()
+        
+        os.makedirs(self.path, exist_ok=True)
+    
+    def key(self, geometry, item_types, api_filter):
+        text = json.dumps({"geometry": geometry, "item_types": sorted(item_types), "filter": api_filter}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+    
+    def lookup(self, geometry, item_types, api_filter):
+        """
+        Returns an iterator over the cached features for the search, or None if there are 
+        none.  A search for some of the default item types is also answered from a cached 
+        search of all the default item types, e.g. an order reusing the results of the 
+        search command.
+        """
+        
+        features = self.load(self.key(geometry, item_types, api_filter))
+        
+        if features == None and set(item_types) < set(default_item_type):
+            features = self.load(self.key(geometry, default_item_type, api_filter))
+            
+            if features != None:
+                features = (x for x in features if x["properties"]["item_type"] in item_types)
+        
+        return features
+    
+    def load(self, key):
+        file_path = os.path.join(self.path, key + ".ndjson")
+        
+        try:
+            if time.time() - os.path.getmtime(file_path) > self.ttl:
+                return None
+            
+            # Record the access time, used to find the least recently used results
+            os.utime(file_path, (time.time(), os.path.getmtime(file_path)))
+            
+            return read_ndjson(open(file_path, "r"))
+            
+        except OSError:
+            return None
+    
+    def writer(self, geometry, item_types, api_filter):
+        """
+        Returns an ndjson_writer storing the features of the search in the cache.  Call 
+        evict once it has been committed.
+        """
+        
+        return ndjson_writer(os.path.join(self.path, self.key(geometry, item_types, api_filter) + ".ndjson"))
+    
+    def evict(self):
+        """
+        Removes expired results, then the least recently used ones until the cache fits 
+        in its maximum size.
+        """
+        
+        with self.lock:
+            entries = []
+            
+            for name in os.listdir(self.path):
+                if name.endswith(".ndjson") == False:
+                    continue
+                
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    continue
+                
+                if time.time() - stat.st_mtime > self.ttl:
+                    remove_file(os.path.join(self.path, name))
+                else:
+                    entries.append((stat.st_atime, stat.st_size, name))
+            
+            total = sum([x[1] for x in entries])
+            
+            for atime, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                
+                remove_file(os.path.join(self.path, name))
+                total -= size
+
+
+class search_history:
+    """
+    Results of previous searches of each site, used by incremental searches.  The 
+    features found for a site are stored in a newline delimited JSON file, next to a 
+    JSON file holding the latest 'published' timestamp among them.  Later searches only 
+    ask Planet for items published since that high-water mark and merge them into the 
+    stored results.  Unlike the search_cache, the stored results do not expire.
+    """
+    
+    def __init__(self, path=cache_dir):
+        self.path = os.path.join(path, "incremental")
+        
+        os.makedirs(self.path, exist_ok=True)
+    
+    def file_path(self, geometry, item_types, api_filter):
+        text = json.dumps({"geometry": geometry, "item_types": sorted(item_types), "filter": api_filter}, sort_keys=True)
+        return os.path.join(self.path, hashlib.sha256(text.encode()).hexdigest() + ".json")
+    
+    def load(self, geometry, item_types, api_filter):
+        """
+        Returns the stored record, a dict with the 'high_water' mark and an iterator over 
+        the 'features' of the previous searches, or None if the site was never searched.
+        """
+        
+        file_path = self.file_path(geometry, item_types, api_filter)
+        
+        try:
+            with open(file_path, "r") as file:
+                record = json.load(file)
+            
+            # The features are stored next to the record
+            record["features"] = read_ndjson(open(os.path.splitext(file_path)[0] + ".ndjson", "r"))
+                
+        except (OSError, ValueError):
+            return None
+        
+        return record
+    
+    def writer(self, geometry, item_types, api_filter):
+        """
+        Returns an ndjson_writer storing the features of the search, the high-water mark 
+        is updated when it is committed.
+        """
+        
+        return history_writer(self.file_path(geometry, item_types, api_filter))
+
+
+class footprint_index:
+    """
+    Local SQLite index of the footprints of the items found by previous searches, with 
+    an R-tree over their bounding boxes.  The areas searched are recorded too, so a new 
+    or changed AOI can be answered from the index, only asking Planet for the parts of 
+    the AOI that were not searched recently.  Items and areas are kept per search 
+    criteria, i.e. item types and filter, as a change of e.g. the cloud cover returns 
+    other items.
+    """
+    
+    def __init__(self, path=cache_dir, ttl=cache_ttl):
+        os.makedirs(path, exist_ok=True)
+        
+        self.path = os.path.join(path, "footprints.sqlite")
+        self.ttl = ttl * 3600
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS items (criteria TEXT, id TEXT, json TEXT, UNIQUE (criteria, id))")
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS item_bounds USING rtree (id, min_x, max_x, min_y, max_y)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS areas (criteria TEXT, searched_on REAL, ring TEXT)")
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS area_bounds USING rtree (id, min_x, max_x, min_y, max_y)")
+            
+            # Areas searched too long ago may be missing new items
+            expired = [x[0] for x in self.db.execute("SELECT rowid FROM areas WHERE searched_on < ?", (time.time() - self.ttl,))]
+            self.db.executemany("DELETE FROM areas WHERE rowid = ?", [(x,) for x in expired])
+            self.db.executemany("DELETE FROM area_bounds WHERE id = ?", [(x,) for x in expired])
+    
+    def criteria(self, item_types, api_filter):
+        text = json.dumps({"item_types": sorted(item_types), "filter": api_filter}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+    
+    def add(self, criteria, features):
+        """
+        Adds or updates items of a search.
+        """
+        
+        with self.lock, self.db:
+            for feature in features:
+                self.db.execute("DELETE FROM item_bounds WHERE id IN (SELECT rowid FROM items WHERE criteria = ? AND id = ?)", (criteria, feature["id"]))
+                cursor = self.db.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?)", (criteria, feature["id"], json.dumps(feature)))
+                
+                bounds = [ring_bounds(x) for x in outer_rings(feature["geometry"])]
+                self.db.execute("INSERT INTO item_bounds VALUES (?, ?, ?, ?, ?)", 
+                                (cursor.lastrowid, min([x[0] for x in bounds]), max([x[2] for x in bounds]), 
+                                 min([x[1] for x in bounds]), max([x[3] for x in bounds])))
+    
+    def add_area(self, criteria, ring):
+        """
+        Records that all the items of an area were added for the criteria.
+        """
+        
+        bounds = ring_bounds(ring)
+        
+        with self.lock, self.db:
+            cursor = self.db.execute("INSERT INTO areas VALUES (?, ?, ?)", (criteria, time.time(), json.dumps(ring)))
+            self.db.execute("INSERT INTO area_bounds VALUES (?, ?, ?, ?, ?)", (cursor.lastrowid, bounds[0], bounds[2], bounds[1], bounds[3]))
+    
+    def covers(self, criteria, ring):
+        """
+        Returns True if a recently searched area contains the ring.
+        """
+        
+        if len(ring) == 0:
+            return True
+        
+        bounds = ring_bounds(ring)
+        
+        with self.lock:
+            areas = self.db.execute("SELECT areas.ring FROM area_bounds JOIN areas ON areas.rowid = area_bounds.id " + 
+                                    "WHERE areas.criteria = ? AND areas.searched_on >= ? AND min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?",
+                                    (criteria, time.time() - self.ttl, bounds[0], bounds[2], bounds[1], bounds[3])).fetchall()
+        
+        return any([ring_contains(json.loads(x[0]), ring) for x in areas])
+    
+    def query(self, criteria, bounds):
+        """
+        Yields the items whose bounding box intersects the (min_x, min_y, max_x, max_y) 
+        bounds.
+        """
+        
+        with self.lock:
+            cursor = self.db.execute("SELECT items.json FROM item_bounds JOIN items ON items.rowid = item_bounds.id " + 
+                                     "WHERE items.criteria = ? AND min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?",
+                                     (criteria, bounds[2], bounds[0], bounds[3], bounds[1]))
+        
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(500)
+            
+            if len(rows) == 0:
+                break
+            
+            for row in rows:
+                yield json.loads(row[0])
+
+
+class ndjson_writer:
+    """
+    Writes features to a newline delimited JSON file as they are processed.  The file 
+    only appears once commit is called, so an interrupted search does not leave 
+    incomplete results behind.
+    """
+    
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.tmp_path = "{}.{}.tmp".format(file_path, threading.get_ident())
+        self.count = 0
+        
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self.file = open(self.tmp_path, "w")
+    
+    def write(self, feature):
+        self.file.write(json.dumps(feature) + "\n")
+        self.count += 1
+    
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.file_path)
+    
+    def discard(self):
+        self.file.close()
+        remove_file(self.tmp_path)
+
+
+class history_writer(ndjson_writer):
+    """
+    ndjson_writer for the search_history, tracking the latest 'published' timestamp of 
+    the features written.
+    """
+    
+    def __init__(self, record_path):
+        ndjson_writer.__init__(self, os.path.splitext(record_path)[0] + ".ndjson")
+        self.record_path = record_path
+        self.high_water = None
+    
+    def write(self, feature):
+        published = feature["properties"].get("published")
+        
+        if published != None and (self.high_water == None or published > self.high_water):
+            self.high_water = published
+        
+        ndjson_writer.write(self, feature)
+    
+    def commit(self):
+        ndjson_writer.commit(self)
+        
+        record = {"high_water": self.high_water,
+                  "updated": dt.now(timezone.utc).strftime(date_format),
+                  "count": self.count}
+        
+        tmp_path = "{}.{}.tmp".format(self.record_path, threading.get_ident())
+        
+        with open(tmp_path, "w") as file:
+            json.dump(record, file)
+            
+        os.replace(tmp_path, self.record_path)
+
+
+def read_ndjson(file):
+    """
+    Yields the features of an open newline delimited JSON file, then closes it.
+    """
+    
+    with file:
+        for line in file:
+            yield json.loads(line)
+
+
+def unique_features(features):
+    """
+    Passes the features through, skipping the ones whose ID was already seen.
+    """
+    
+    seen = set()
+    
+    for feature in features:
+        if feature["id"] not in seen:
+            seen.add(feature["id"])
+            yield feature
+
+
+def geometry_filter(coordinates):
+    """
+    Returns a GeometryFilter selecting the items intersecting a polygon.
+    """
+    
+    return {"type": "GeometryFilter",
+            "field_name": "geometry",
+            "config": {
+              "type": "Polygon",
+              "coordinates": coordinates
+            }
+        }
+
+
+def outer_rings(geometry):
+    """
+    Returns the outer ring of a Polygon, or of each polygon of a MultiPolygon.
+    """
+    
+    if geometry["type"] == "MultiPolygon":
+        return [x[0] for x in geometry["coordinates"]]
+    
+    return [geometry["coordinates"][0]]
+
+
+def ring_bounds(ring):
+    """
+    Returns the (min_x, min_y, max_x, max_y) bounding box of a ring.
+    """
+    
+    return (min([x[0] for x in ring]), min([x[1] for x in ring]), 
+            max([x[0] for x in ring]), max([x[1] for x in ring]))
+
+
+def point_in_ring(point, ring):
+    """
+    Ray casting test of whether a point is inside a ring.
+    """
+    
+    x, y = point[0], point[1]
+    inside = False
+    
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    
+    return inside
+
+
+def side(p, q, r):
+    """
+    Returns 1 if r is left of the line p-q, -1 if it is right of it and 0 if the 
+    three points are collinear, within a tolerance of about 1e-9 degrees.
+    """
+    
+    value = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    tolerance = 1e-9 * max(abs(q[0] - p[0]), abs(q[1] - p[1]), 1e-9)
+    
+    return (value > tolerance) - (value < -tolerance)
+
+
+def on_segment(p, q, r):
+    """
+    Returns True if r, collinear with p-q, lies on the segment p-q.
+    """
+    
+    return min(p[0], q[0]) - 1e-9 <= r[0] <= max(p[0], q[0]) + 1e-9 and min(p[1], q[1]) - 1e-9 <= r[1] <= max(p[1], q[1]) + 1e-9
+
+
+def segments_cross(a, b, c, d, touching=True):
+    """
+    Returns True if the segments a-b and c-d intersect.  With touching set to False, 
+    only segments crossing each other at a single inner point are reported.
+    """
+    
+    s1, s2, s3, s4 = side(a, b, c), side(a, b, d), side(c, d, a), side(c, d, b)
+    
+    if s1 * s2 < 0 and s3 * s4 < 0:
+        return True
+    
+    if touching == False:
+        return False
+    
+    if s1 != s2 and s3 != s4:
+        return True
+    
+    # Collinear points lying on the other segment
+    return ((s1 == 0 and on_segment(a, b, c)) or (s2 == 0 and on_segment(a, b, d)) or 
+            (s3 == 0 and on_segment(c, d, a)) or (s4 == 0 and on_segment(c, d, b)))
+
+
+def rings_intersect(a, b):
+    """
+    Returns True if the polygons of two rings intersect, i.e. one contains a vertex 
+    of the other or their edges cross.
+    """
+    
+    a_bounds = ring_bounds(a)
+    b_bounds = ring_bounds(b)
+    
+    if a_bounds[2] < b_bounds[0] or b_bounds[2] < a_bounds[0] or a_bounds[3] < b_bounds[1] or b_bounds[3] < a_bounds[1]:
+        return False
+    
+    if point_in_ring(a[0], b) or point_in_ring(b[0], a):
+        return True
+    
+    return any([segments_cross(a[i], a[i + 1], b[j], b[j + 1]) for i in range(len(a) - 1) for j in range(len(b) - 1)])
+
+
+def ring_contains(outer, inner):
+    """
+    Returns True if the ring inner lies inside the ring outer, or on its boundary.  All 
+    vertices and edge midpoints of inner must be inside or on the boundary of outer, 
+    and no edges may cross.
+    """
+    
+    edges = list(zip(outer[:-1], outer[1:]))
+    
+    def inside(p):
+        return point_in_ring(p, outer) or any([side(a, b, p) == 0 and on_segment(a, b, p) for a, b in edges])
+    
+    midpoints = [[(p[0] + q[0]) / 2, (p[1] + q[1]) / 2] for p, q in zip(inner[:-1], inner[1:])]
+    
+    if all([inside(x) for x in inner + midpoints]) == False:
+        return False
+    
+    return any([segments_cross(a, b, c, d, touching=False) for a, b in edges for c, d in zip(inner[:-1], inner[1:])]) == False
+
+
+def clip_ring(ring, rectangle):
+    """
+    Clips a ring to a rectangular ring, using the Sutherland-Hodgman algorithm.
+
+    Returns
+    -------
+    ring : list
+        The closed ring of the clipped polygon, empty if they do not overlap.
+
+    """
+    
+    min_x, min_y, max_x, max_y = ring_bounds(rectangle)
+    
+    edges = [(lambda p: p[0] >= min_x, lambda p, q: [min_x, p[1] + (q[1] - p[1]) * (min_x - p[0]) / (q[0] - p[0])]),
+             (lambda p: p[0] <= max_x, lambda p, q: [max_x, p[1] + (q[1] - p[1]) * (max_x - p[0]) / (q[0] - p[0])]),
+             (lambda p: p[1] >= min_y, lambda p, q: [p[0] + (q[0] - p[0]) * (min_y - p[1]) / (q[1] - p[1]), min_y]),
+             (lambda p: p[1] <= max_y, lambda p, q: [p[0] + (q[0] - p[0]) * (max_y - p[1]) / (q[1] - p[1]), max_y])]
+    
+    points = ring[:-1] if ring[0] == ring[-1] else ring
+    
+    for inside, crossing in edges:
+        clipped = []
+        
+        for p, q in zip(points[-1:] + points[:-1], points):
+            if inside(q):
+                if inside(p) == False:
+                    clipped.append(crossing(p, q))
+                clipped.append(q)
+            elif inside(p):
+                clipped.append(crossing(p, q))
+        
+        points = clipped
+        
+        if len(points) == 0:
+            return []
+    
+    return points + points[:1]
+
+
+def z_order(x, y, bounds):
+    """
+    Returns the position of a point along a Z-order curve through the (min_x, min_y, 
+    max_x, max_y) bounds.  Points close to each other are mostly close on the curve.
+    """
+    
+    span = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) or 1
+    x = int((x - bounds[0]) / span * 65535)
+    y = int((y - bounds[1]) / span * 65535)
+    
+    return sum([((x >> bit & 1) << (2 * bit)) | ((y >> bit & 1) << (2 * bit + 1)) for bit in range(16)])
+
+
+def group_sites(sites, size):
+    """
+    Splits the sites in groups of at most size sites, keeping sites that are close to 
+    each other in the same group.  The sites are sorted along a Z-order curve through 
+    the centers of their bounding boxes.
+    """
+    
+    centers = []
+    
+    for site in sites:
+        bounds = ring_bounds(site.aoi_feature["coordinates"][0])
+        centers.append(((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2))
+    
+    bounds = (min([x[0] for x in centers]), min([x[1] for x in centers]), 
+              max([x[0] for x in centers]), max([x[1] for x in centers]))
+    
+    ordered = [site for key, index, site in sorted([(z_order(c[0], c[1], bounds), i, x) for i, (c, x) in enumerate(zip(centers, sites))])]
+    
+    return [ordered[x:x+size] for x in range(0, len(ordered), size)]
+
+
+def batch_search(sites, quick_url=quick_url, item_types=default_item_type, cache=None, features_dir=None):
+    """
+    Searches a group of sites with a single quick search, using an OrFilter of their 
+    geometries, then assigns each item found to the sites whose polygon it intersects.
+    The sites must share the same search criteria.  Sites found in the cache are not 
+    searched again.
+
+    Parameters
+    ----------
+    sites : list
+        aoi objects to search.
+    cache : search_cache, optional
+        The default is None. Cache of previous search results, the results of each site 
+        are stored in it as if the site had been searched on its own.
+    features_dir : str, optional
+        The default is None. Directory where the features found for each site are saved 
+        to <site name>.ndjson.
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    def features_path(site):
+        return os.path.join(features_dir, site.site_name + ".ndjson") if features_dir != None else None
+    
+    remaining = []
+    
+    for site in sites:
+        if cache != None and cache.lookup(site.aoi_feature, item_types, site.api_filter) != None:
+            site.item_search(quick_url, item_types, show_progress=False, cache=cache, features_path=features_path(site))
+        else:
+            remaining.append(site)
+    
+    if len(remaining) == 0:
+        return
+    
+    writers = {}
+    
+    for site in remaining:
+        site.results = search_table()
+        site.order_chunks = None
+        site.features_path = None
+        writers[site.site_name] = []
+        
+        if features_path(site) != None:
+            writers[site.site_name].append(ndjson_writer(features_path(site)))
+        
+        if cache != None:
+            writers[site.site_name].append(cache.writer(site.aoi_feature, item_types, site.api_filter))
+    
+    lead = remaining[0]    # Site whose search runs the request for the group
+    lead.__write_log__("Searching {} sites together: {}".format(len(remaining), ", ".join([x.site_name for x in remaining])))
+    
+    lead.search_failed = False
+    geometries = {"type": "OrFilter", "config": [geometry_filter(x.aoi_feature["coordinates"]) for x in remaining]}
+    
+    for page in lead.__quick_search__(quick_url, item_types, lead.api_filter, show_progress=False, geometry=geometries):
+        for feature in page:
+            for site in remaining:
+                if site.intersects(feature["geometry"]):
+                    site.results.append(feature)
+                    
+                    for writer in writers[site.site_name]:
+                        writer.write(feature)
+    
+    for site in remaining:
+        if lead.search_failed:
+            for writer in writers[site.site_name]:
+                writer.discard()
+            
+            site.results = search_table()
+        else:
+            site.__commit__(writers[site.site_name], features_path(site))
+    
+    if cache != None:
+        cache.evict()
+
+
+def date_shards(min_year, max_year, shard):
+    """
+    Splits the years from min_year up to, but excluding, max_year in periods of a 
+    'year', 'quarter' or 'month'.
+
+    Returns
+    -------
+    filters : list
+        DateRangeFilter on the acquired date of each period, in chronological order.
+
+    """
+    
+    months = {"year": 12, "quarter": 3, "month": 1}[shard]
+    filters = []
+    
+    for start in range((min_year * 12), (max_year * 12), months):
+        end = start + months
+        filters.append({"type": "DateRangeFilter",
+                        "field_name": "acquired",
+                        "config": {"gte": "{}-{:02d}-01T00:00:00.000Z".format(start // 12, start % 12 + 1),
+                                   "lt": "{}-{:02d}-01T00:00:00.000Z".format(end // 12, end % 12 + 1)}})
+    
+    return filters
+
+
+def grid_cells(coordinates, tiles):
+    """
+    Splits the bounding box of polygon coordinates in a grid of tiles x tiles cells.
+
+    Returns
+    -------
+    cells : list
+        Coordinates of the polygon of each cell.
+
+    """
+    
+    ring = coordinates[0]
+    min_x = min([x[0] for x in ring])
+    max_x = max([x[0] for x in ring])
+    min_y = min([x[1] for x in ring])
+    max_y = max([x[1] for x in ring])
+    width = (max_x - min_x) / tiles
+    height = (max_y - min_y) / tiles
+    cells = []
+    
+    for col in range(tiles):
+        for row in range(tiles):
+            x0 = min_x + col * width
+            y0 = min_y + row * height
+            x1 = max_x if col == tiles - 1 else x0 + width
+            y1 = max_y if row == tiles - 1 else y0 + height
+            cells.append([[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]])
+    
+    return cells
+
+
+def spill(features, writers):
+    """
+    Passes the features through, writing each of them to the writers on the way.
+    """
+    
+    for feature in features:
+        for writer in writers:
+            writer.write(feature)
+        
+        yield feature
+
+
+def remove_file(path):
+    """
+    Removes a file, ignoring it if it was already removed.
+    """
+    
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def setup_filter(minyear, maxyear, allowed, api_cloud_cover_min=0.0, api_cloud_cover_max=0.5 ):
+    """
+    Setup a basic search filter to use with Planet API
+
+    Parameters
+    ----------
+    minyear : int
+        Starting year search.
+    maxyear : int
+        End year search, excludes the maxyear.
+    assets : list
+        Assetts to search.
     api_cloud_cover_min : double, optional
         The default is 0.0. Minimal cloud cover in range of 0.0 - 1.0, where 1.0 is 100%.
     api_cloud_cover_max : double
@@ -627,73 +2326,253 @@ def get_gjson_filelist(geojson_path):
     print("\n")
     return paths_list
 
-def get_order_list(order_url=orders_url):
+def get_order_pages(order_url=orders_url):
+    """
+    Generator over the pages of the order list, newest orders first.
+
+    Parameters
+    ----------
+    order_url : str, optional
+        The default is orders_url. The url of the Planet Orders API.
+
+    Yields
+    ------
+    orders : list
+        The orders of one page.
+
+    """
     
-    PLANET_API_KEY = get_api_key()
-    orders_list = []
+    next_url = order_url
+    
+    while(next_url != None):
+        
+        response = get_client().get(next_url)
+        
+        if(response.status_code != 200):
+            raise requests.exceptions.HTTPError("Error retrieving the order list.  Status Code: {}".format(response.status_code))
+        
+        order_resp = response.json()
+        next_url = order_resp["_links"].get("next")
+        
+        yield order_resp.get("orders", [])
+
+
+class order_index:
+    """
+    Local SQLite index of the orders on the Planet account.  The index is synced 
+    incrementally: only the pages of the order list holding orders that are not in the 
+    index yet are retrieved, and orders that were still being processed at the last 
+    sync are refreshed one by one.  Orders are then queried by name pattern, creation 
+    date and state without scanning the whole order list.
+    
+    The incremental sync only stops early once a sync went through the whole order list, 
+    so orders missed by an interrupted first sync are indexed by the next one.  Each 
+    Planet account, identified by a hash of its API key, has its own index file.
+    """
+    
+    terminal_states = ["success", "partial", "failed", "cancelled"]
+    
+    def __init__(self, path=cache_dir):
+        os.makedirs(path, exist_ok=True)
+        
+        self.dir = path
+        self.path = None
+        self.lock = threading.Lock()
+        self.connect_lock = threading.Lock()
+        self.db = None
+    
+    def __connect__(self):
+        # Opened on first use, the API key is only known once the user is authenticated
+        with self.connect_lock:
+            if self.db == None:
+                account = hashlib.sha256(get_api_key().encode()).hexdigest()[:16]
+                self.path = os.path.join(self.dir, "orders_{}.sqlite".format(account))
+                self.db = sqlite3.connect(self.path, check_same_thread=False)
+                
+                with self.lock, self.db:
+                    self.db.execute("CREATE TABLE IF NOT EXISTS orders (id TEXT PRIMARY KEY, name TEXT, state TEXT, created_on TEXT, json TEXT)")
+                    self.db.execute("CREATE INDEX IF NOT EXISTS orders_name ON orders (name)")
+                    self.db.execute("CREATE INDEX IF NOT EXISTS orders_created_on ON orders (created_on)")
+                    self.db.execute("CREATE TABLE IF NOT EXISTS sync (key TEXT PRIMARY KEY, value TEXT)")
+        
+        return self.db
+    
+    def sync(self, order_url=orders_url, full=False):
+        """
+        Updates the index with the orders on the Planet account.
+
+        Parameters
+        ----------
+        order_url : str, optional
+            The default is orders_url. The url of the Planet Orders API.
+        full : bool, optional
+            The default is False. Page through the whole order list instead of stopping 
+            at the first page of orders already in the index.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        db = self.__connect__()
+        
+        with self.lock:
+            known = dict(db.execute("SELECT id, state FROM orders").fetchall())
+            completed = db.execute("SELECT value FROM sync WHERE key = 'full_sync'").fetchone() != None
+            
+        refreshed = set()
+        
+        try:
+            for orders in get_order_pages(order_url):
+                self.update(orders)
+                refreshed.update([x["id"] for x in orders])
+                
+                # The list is sorted newest first, once a page only holds orders seen at the
+                # last sync the remaining pages hold no new orders.  Only true when an earlier
+                # sync went through the whole list.
+                if full == False and completed == True and all([x["id"] in known for x in orders]):
+                    break
+            else:
+                with self.lock, db:
+                    db.execute("INSERT OR REPLACE INTO sync VALUES ('full_sync', ?)", (dt.now(timezone.utc).strftime(date_format),))
+                    
+        except requests.exceptions.RequestException as e:
+            # Keep the pages indexed so far, the next sync goes through the whole list again
+            print("{}.  The order index may be incomplete.".format(e))
+        
+        # Refresh the orders that were still being processed at the last sync
+        for order_id, state in known.items():
+            if state in self.terminal_states or order_id in refreshed:
+                continue
+            
+            response = get_client().get("{}/{}".format(order_url, order_id))
+            
+            if(response.status_code == 200):
+                self.update([response.json()])
+            elif(response.status_code == 404):
+                with self.lock, db:
+                    db.execute("DELETE FROM orders WHERE id = ?", (order_id,))
+    
+    def synced(self, order_url=orders_url, full=False):
+        """
+        Syncs the index and returns it.
+        """
+        
+        self.sync(order_url, full)
+        return self
+    
+    def update(self, orders):
+        db = self.__connect__()
+        
+        with self.lock, db:
+            db.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)",
+                                [(x["id"], x["name"], x["state"], x["created_on"], json.dumps(x)) for x in orders])
+    
+    def query(self, name_search=None, date_search=None, const_oname_list=None, states=None):
+        """
+        Returns the orders matching all of the criteria, newest first.
+
+        Parameters
+        ----------
+        name_search : str, optional
+            The default is None. Order name pattern, using '*' as wildcard.
+        date_search : datetime, optional
+            The default is None. Date the order was created on.
+        const_oname_list : list, optional
+            The default is None. Order name patterns, an order matching any of them is kept.
+        states : list, optional
+            The default is None. States of the orders to keep.
 
-    with requests.Session() as session:
-        # Authenticate
-        session.auth = (PLANET_API_KEY, "")
-        response = session.get(order_url)
+        Returns
+        -------
+        orders : list
+            The order dicts as returned by the Planet Orders API.
 
-        if(response.status_code != 200):
-            print("Error connecting with server.  Status Code: {}".format(response.status_code))
-            return orders_list 
+        """
         
-       
-        order_resp = response.json()
-        if("orders" in order_resp):
-            orders_list.extend(order_resp["orders"])
+        conditions = []
+        params = []
         
+        if name_search != None:
+            conditions.append("name GLOB ?")
+            params.append(glob_pattern(name_search))
         
-        while("next" in response.json()["_links"]):
-            
-            time.sleep(3)
-            next_url = response.json()["_links"]["next"]
-            response = session.get(next_url)
-            
-            if(response.status_code == 200):
-                order_resp = response.json()
-                
-                if("orders" in order_resp):
-                    orders_list.extend(order_resp["orders"])
-                    
-    return orders_list
-
-
-def filter_order_list(order_list, date_search=None, name_search=None, const_oname_list=None):
+        if date_search != None:
+            conditions.append("substr(created_on, 1, 10) = ?")
+            params.append(date_search.strftime("%Y-%m-%d"))
+        
+        if const_oname_list != None:
+            conditions.append("({})".format(" OR ".join(["name GLOB ?"] * len(const_oname_list)) or "0"))
+            params.extend([glob_pattern(x) for x in const_oname_list])
+        
+        if states != None:
+            conditions.append("state IN ({})".format(", ".join(["?"] * len(states))))
+            params.extend(states)
         
-    filtered_olist = []
+        sql = "SELECT json FROM orders"
+        
+        if len(conditions) > 0:
+            sql = "{} WHERE {}".format(sql, " AND ".join(conditions))
+        
+        db = self.__connect__()
+        
+        with self.lock:
+            rows = db.execute(sql + " ORDER BY created_on DESC", params).fetchall()
+        
+        return [json.loads(x[0]) for x in rows]
     
-    for order in order_list:
+    def count(self):
+        db = self.__connect__()
         
-        name_keep=False
-        date_keep=False
-        s_name_keep=False
+        with self.lock:
+            return db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def glob_pattern(pattern):
+    """
+    Converts a fnmatch style pattern to a SQLite GLOB pattern.
+    """
     
-        name_keep = True if (name_search == None or fnmatch.fnmatch(order["name"], name_search)) else False
+    return pattern.replace("[!", "[^")
 
-            
-        order_date = dt.strptime(order["created_on"], date_format)
-        date_keep= True if (date_search == None or (date_search.date() == order_date.date())) else False
 
+class order_snapshot:
+    """
+    The orders of the account, taken once per command and indexed by order name without 
+    its '_chunk_<n>' suffix, i.e. the name built by const_order_name.  Sites look up their 
+    orders with a dictionary lookup instead of each retrieving and scanning the order list.
+    """
     
-        if const_oname_list == None:
-            s_name_keep=True
-        else:
-            for s_name in const_oname_list:
-                if fnmatch.fnmatch(order["name"], s_name) == True:
-                    s_name_keep = True
+    def __init__(self, orders):
+        self.by_name = {}
         
-            
-        if name_keep and date_keep and s_name_keep:
-            filtered_olist.append(order)
+        for order in orders:
+            self.by_name.setdefault(order_base_name(order["name"]), []).append(order)
+    
+    def named(self, order_name, date_search=None):
+        """
+        Returns the orders whose name is order_name followed by a chunk suffix, newest 
+        first.  When date_search is given only the orders created on that date are returned.
+        """
+        
+        orders = self.by_name.get(order_name, [])
+        
+        if date_search != None:
+            orders = [x for x in orders if x["created_on"][:10] == date_search.strftime("%Y-%m-%d")]
+        
+        return orders
+
+
+def order_base_name(name):
+    """
+    Returns the order name without its '_chunk_<n>' suffix.
+    """
     
-    return filtered_olist
+    return re.sub(r"_chunk_\d+$", "", name)
 
 
-def search(geometry_path, min_year, max_year, min_cloud, max_cloud, allowed):
+def search(geometry_path, min_year, max_year, min_cloud, max_cloud, allowed, workers=search_workers, cache=None, history=None, features_dir=None, tiles=1, shard=None, batch=1, footprints=None, cache_dir=cache_dir, part_workers=search_part_workers):
 
     json_files = get_gjson_filelist(geometry_path)
     
@@ -711,10 +2590,42 @@ def search(geometry_path, min_year, max_year, min_cloud, max_cloud, allowed):
                     ) for site in json_files]
 
     
-    for site in aoi_list:
-        print( "------- SEARCH INITIATED FOR {} --------".format(site.site_name))
-        print(site)
-        site.item_search()
+    def features_path(site):
+        if features_dir == None:
+            return None
+        
+        return os.path.join(features_dir, site.site_name + ".ndjson")
+    
+    if batch > 1:
+        for site in aoi_list:
+            print( "------- SEARCH INITIATED FOR {} --------".format(site.site_name))
+            print(site)
+        
+        # Search the sites in groups of nearby sites, several groups at the same time
+        get_client().ensure_pool_size(workers)
+        
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            list(executor.map(lambda group: batch_search(group, cache=cache, features_dir=features_dir), group_sites(aoi_list, batch)))
+        
+        print("\n")
+    elif workers <= 1:
+        for site in aoi_list:
+            print( "------- SEARCH INITIATED FOR {} --------".format(site.site_name))
+            print(site)
+            site.item_search(cache=cache, history=history, features_path=features_path(site), tiles=tiles, shard=shard, footprints=footprints, part_workers=part_workers)
+    else:
+        for site in aoi_list:
+            print( "------- SEARCH INITIATED FOR {} --------".format(site.site_name))
+            print(site)
+        
+        # Search several sites at the same time.  Rate limiting is handled by the shared
+        # client and the summaries below are printed in the order of the GeoJSON files.
+        get_client().ensure_pool_size(workers)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda site: site.item_search(show_progress=False, cache=cache, history=history, features_path=features_path(site), tiles=tiles, shard=shard, footprints=footprints, part_workers=part_workers), aoi_list))
+        
+        print("\n")
     
     print("############################################")
     print("###### SUMMARY OF SEARCH RESULTS  ##########")
@@ -723,9 +2634,73 @@ def search(geometry_path, min_year, max_year, min_cloud, max_cloud, allowed):
         print( "---------------- SITE: {} --------------------".format(site.site_name.upper()))
         print(site)
         site.print_search()
+    
+    # Definitions of the item types and asset types found at any site
+    print("############################################")
+    print("###### DEFINITIONS  ########################")
+    print("############################################")
+    print_definitions(aoi_list, cache_dir)
         
   
         
+def estimate(geometry_path, min_year, max_year, min_cloud, max_cloud, allowed, item_types=default_item_type, interval="year", workers=search_workers):
+    """
+    Prints the number of items of each site per period, using the stats endpoint of the 
+    Data API, and the number of order chunks the items would need.
+    """
+    
+    json_files = get_gjson_filelist(geometry_path)
+    
+    # Check if the Planet base server is up and running
+    check_base_server()
+    
+    aoi_list = [aoi(geom_path = site, 
+                    min_year = min_year,
+                    max_year = max_year,
+                    min_cloud = min_cloud,
+                    max_cloud = max_cloud,
+                    allowed = allowed
+                    ) for site in json_files]
+    
+    get_client().ensure_pool_size(workers)
+    
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = list(executor.map(lambda site: site.item_stats(item_types, interval), aoi_list))
+    
+    print("############################################")
+    print("###### ESTIMATED SEARCH RESULTS  ###########")
+    print("############################################")
+    print("Item Types: {}\n".format(", ".join(item_types)))
+    
+    total = 0
+    
+    for site, buckets in zip(aoi_list, results):
+        print( "---------------- SITE: {} --------------------".format(site.site_name.upper()))
+        
+        if buckets == None:
+            print("Failed to retrieve the item counts.\n")
+            continue
+        
+        count = sum([x[1] for x in buckets])
+        chunks = -(-count // order_chunk_size)
+        total = total + count
+        
+        print("{:30}{:>10}".format("Period Start", "Items"))
+        
+        for start_time, bucket_count in buckets:
+            print("{:30}{:>10}".format(start_time[:10], bucket_count))
+        
+        print("{:30}{:>10}".format("Total", count))
+        print("Order chunks needed: {}".format(chunks))
+        
+        if chunks >= order_max_chunks:
+            print("WARNING: More than {} chunks will exceed Planet API order capacity.".format(order_max_chunks))
+        
+        print("")
+    
+    print("Total items for all sites: {}".format(total))
+
+
 def order(geometry_path, 
          min_year, 
          max_year, 
@@ -734,7 +2709,18 @@ def order(geometry_path,
          api_item_type, 
          product_bundle,
          prefix, 
-         clip):
+         clip,
+         cache=None,
+         orders=None,
+         manifest=None,
+         max_in_flight=order_in_flight,
+         tiles=1,
+         shard=None,
+         footprints=None,
+         chunk_items=order_chunk_size,
+         chunk_mb=None,
+         item_mb=None,
+         part_workers=search_part_workers):
 
     
     json_files = get_gjson_filelist(geometry_path)
@@ -743,6 +2729,12 @@ def order(geometry_path,
     # Check if the Planet base server is up and running
     check_base_server()  
     
+    # Retrieve the order list once, all sites check their order name against it
+    if orders == None:
+        orders = order_index()
+    
+    snapshot = order_snapshot(orders.synced().query())
+    
     order_list = [aoi_order(geom_path = site, 
                     min_year = min_year,
                     max_year = max_year,
@@ -751,12 +2743,35 @@ def order(geometry_path,
                     item_type = api_item_type,
                     bundle = product_bundle,
                     prefix = prefix, 
-                    clip = clip
+                    clip = clip,
+                    cache = cache,
+                    orders = snapshot,
+                    manifest = manifest,
+                    tiles = tiles,
+                    shard = shard,
+                    footprints = footprints,
+                    chunk_items = chunk_items,
+                    chunk_mb = chunk_mb,
+                    item_mb = item_mb,
+                    part_workers = part_workers
                     ) for site in json_files]
     
+    # Submit the chunks of all sites, with at most max_in_flight requests at a time, then
+    # print the results in the order of the sites.
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        results = [site.submit_order(manifest=manifest, executor=executor) for site in order_list]
+        
+        for site, site_results in zip(order_list, results):
+            site.print_order_results(site_results)
     
-    for site in order_list:
-        site.place_order()
+    if manifest != None:
+        print("Order results were written to: {}".format(manifest.path))
+        
+        if manifest.failed_count() > 0:
+            print("{} chunks were not accepted.  Run the same order command again to resubmit them.\n".format(manifest.failed_count()))
+        
+        if manifest.deferred_count() > 0:
+            print("{} chunks are planned for later batches.  Run the same order command again once the orders above have been processed to submit the next batch.\n".format(manifest.deferred_count()))
         
     
     
@@ -777,7 +2792,9 @@ def check(order_name_search=None,
           min_year=None,
           max_year=None,
           geometry_path=None, 
-          prefix=None):
+          prefix=None,
+          orders=None,
+          full_sync=False):
     
     
     prefix = prefix + "_" if prefix != None else ""
@@ -793,24 +2810,48 @@ def check(order_name_search=None,
             s_order_names.append(order_name + "*")
             
             
-    date_search=None
-    if order_date_search != None:
-        try:
-            date_search = dt.strptime(order_date_search, "%Y-%m-%d")
-        except ValueError as e:
-            raise ValueError("{} \n\n Verify the -date, --order_date is formatted properly, as YYYY-MM-DD.\n Your entry: {}".format(e, order_date_search))
-    
+    date_search = parse_order_date(order_date_search)
     
-    orders_list = get_order_list() 
+    if orders == None:
+        orders = order_index()
+        
+    orders.sync(order_url, full=full_sync)
                
-    if len(orders_list) == 0:
+    if orders.count() == 0:
         raise ValueError("No orders found.")
         
-    filtered_olist = filter_order_list(orders_list, 
-                      date_search=date_search,
+    filtered_olist = orders.query(date_search=date_search,
                       name_search=order_name_search,
                       const_oname_list=s_order_names)
     
+    return summarize_orders(filtered_olist, order_name_search, order_date_search)
+
+
+def parse_order_date(order_date_search):
+    """
+    Parses the -odate, --order_date option, formatted as YYYY-MM-DD.  Returns None if 
+    the option is not used.
+    """
+    
+    if order_date_search == None:
+        return None
+    
+    try:
+        return dt.strptime(order_date_search, "%Y-%m-%d")
+    except ValueError as e:
+        raise ValueError("{} \n\n Verify the -date, --order_date is formatted properly, as YYYY-MM-DD.\n Your entry: {}".format(e, order_date_search))
+
+
+def summarize_orders(filtered_olist, order_name_search=None, order_date_search=None):
+    """
+    Prints the failed, not ready and ready orders.
+
+    Returns
+    -------
+    success_orders : list
+        The orders ready to download, or None if no orders matched the filter criteria.
+
+    """
     
     if len(filtered_olist) == 0:
         print("\n\nNo orders found using specified filter criteria.")
@@ -846,15 +2887,438 @@ def check(order_name_search=None,
     return success_orders
         
         
-def get_data(order_list, output_dir):
+class download_progress:
+    """
+    Thread safe tracker of the files downloaded for all the orders of a download.  Prints 
+    one status line with the files downloaded, the aggregate throughput of the transfers 
+    in flight and the estimated time left.
+    """
+    
+    rate_window = 10    # Seconds over which the throughput is measured
+    
+    def __init__(self, total, success=0):
+        self.lock = threading.Lock()
+        self.total = total
+        self.success = success
+        self.failed = 0
+        self.pending = {}
+        self.received = 0
+        self.finished_bytes = 0
+        self.samples = []
+        self.last_print = 0
+    
+    def expect(self, name, size=None):
+        # Register a file to download and its size, when known in advance
+        with self.lock:
+            self.pending[name] = [0, size]
+        
+    def start(self, name, size, offset=0):
+        with self.lock:
+            self.pending[name] = [offset, size if size != None else self.pending.get(name, [0, None])[1]]
+            
+    def update(self, name, nbytes):
+        with self.lock:
+            self.pending[name][0] += nbytes
+            self.received += nbytes
+            
+            # Limit how often the console line is refreshed
+            if time.monotonic() - self.last_print > 0.5:
+                self.__print__()
+    
+    def finish(self, name, success):
+        with self.lock:
+            done, size = self.pending.pop(name, [0, None])
+            
+            if success:
+                self.success += 1
+                self.finished_bytes += done
+            else:
+                self.failed += 1
+            
+            self.__print__()
+    
+    def rate(self):
+        """
+        Returns the bytes per second received over the last rate_window seconds.
+        """
+        
+        if len(self.samples) < 2 or self.samples[-1][0] == self.samples[0][0]:
+            return 0
+        
+        return (self.samples[-1][1] - self.samples[0][1]) / (self.samples[-1][0] - self.samples[0][0])
+    
+    def remaining(self):
+        """
+        Returns the estimated number of bytes left to download.  Files of unknown size 
+        are assumed to be as large as the average of the other files.
+        """
+        
+        sizes = [size for done, size in self.pending.values() if size != None]
+        known = sum(sizes) + self.finished_bytes
+        count = len(sizes) + self.success
+        average = known / count if count > 0 else 0
+        
+        return sum([(size if size != None else average) - done for done, size in self.pending.values()])
+    
+    def __print__(self):
+        now = time.monotonic()
+        self.last_print = now
+        
+        self.samples.append((now, self.received))
+        while now - self.samples[0][0] > self.rate_window and len(self.samples) > 2:
+            self.samples.pop(0)
+        
+        rate = self.rate()
+        output = "\rDownloaded: {} of {} files Failed: {}  {} at {}/s".format(self.success, self.total, self.failed, format_size(self.received), format_size(rate))
+        
+        if rate > 0 and len(self.pending) > 0:
+            seconds = int(self.remaining() / rate)
+            output = "{}  ETA {}:{:02d}:{:02d}".format(output, seconds // 3600, seconds // 60 % 60, seconds % 60)
+        
+        print("{:100.150}".format(output), end='', flush=True)
+
+
+class download_scheduler:
+    """
+    Shares the bandwidth between the files downloaded at the same time.  The total rate 
+    of all the downloads is capped to max_rate bytes per second, at most host_connections 
+    files are downloaded from the same host at once, and the files of the orders are 
+    queued according to one of the priorities:
+        
+        order       : the files of one order at a time, in the order of the order list.
+        round_robin : one file of each order in turn.
+        smallest    : the smallest files first, from the sizes in the order manifest.
+    """
+    
+    priorities = ["order", "round_robin", "smallest"]
+    
+    def __init__(self, max_rate=None, host_connections=None):
+        self.max_rate = max_rate
+        self.host_connections = host_connections
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.next_time = 0
+    
+    def connection(self, url):
+        """
+        Returns the semaphore limiting the connections to the host of url, used as 
+        'with scheduler.connection(url):'.
+        """
+        
+        host = requests.utils.urlparse(url).netloc if self.host_connections != None else None
+        
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.host_connections if host != None else 1 << 30)
+                
+            return self.hosts[host]
+    
+    def throttle(self, nbytes):
+        """
+        Waits until nbytes more bytes fit in the max_rate cap.  Each chunk reserves its 
+        share of the bandwidth after the chunks received before it, and an idle link 
+        can burst for up to one second.
+        """
+        
+        if self.max_rate == None:
+            return
+        
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now - 1) + nbytes / self.max_rate
+            delay = self.next_time - now
+        
+        if delay > 0:
+            time.sleep(delay)
+    
+    def queue(self, files, priority="order"):
+        """
+        Sorts the files to download, tuples of (order number, index in the order, size), 
+        according to priority.
+        """
+        
+        if priority == "round_robin":
+            return sorted(files, key=lambda x: (x[1], x[0]))
+        
+        if priority == "smallest":
+            return sorted(files, key=lambda x: (x[2] == None, x[2] or 0, x[0], x[1]))
+        
+        return sorted(files, key=lambda x: (x[0], x[1]))
+
+
+class download_journal:
+    """
+    Small on-disk record of the expected size and MD5 digest of each file downloaded to 
+    an output directory.  Used to resume interrupted downloads from their '.part' file 
+    and to verify files before they are committed under their final name.
+    
+    Each change is appended to the journal as one JSON object per line, and reading the 
+    journal replays the lines, so recording a file never rewrites the whole journal.
+    """
+    
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, journal_filename)
+        self.lock = threading.Lock()
+        self.entries = {}
+        
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by an interrupted download
+                        continue
+                    
+                    name = entry.pop("name")
+                    
+                    if entry.pop("removed", False) == True:
+                        self.entries.pop(name, None)
+                    else:
+                        self.entries.setdefault(name, {}).update(entry)
+    
+    def get(self, name):
+        with self.lock:
+            return self.entries.get(name)
+    
+    def record(self, name, **fields):
+        with self.lock:
+            self.entries.setdefault(name, {}).update(fields)
+            self.__append__(dict(fields, name=name))
+    
+    def remove(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) != None:
+                self.__append__({"name": name, "removed": True})
+    
+    def is_complete(self, name, path):
+        """
+        Returns True if the file exists and, when the journal knows its expected size, 
+        the file on disk has that size.
+        """
+        
+        if os.path.isfile(path) == False:
+            return False
+        
+        entry = self.get(name)
+        
+        if entry == None or entry.get("size") == None:
+            return True
+        
+        return os.path.getsize(path) == entry["size"]
+    
+    def __append__(self, entry):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def response_md5(headers):
+    """
+    Returns the base64 encoded MD5 digest advertised by the storage server in the 
+    'x-goog-hash' or 'Content-MD5' response headers, or None if there is none.
+    """
+    
+    for value in headers.get("x-goog-hash", "").split(","):
+        
+        key, _, digest = value.strip().partition("=")
+        
+        if key == "md5":
+            return digest
+    
+    return headers.get("Content-MD5")
+
+
+def content_range_size(headers):
+    """
+    Returns the complete size of the file from the 'Content-Range' response header, or 
+    None if the header is missing or the server does not know the size ('*').
+    """
+    
+    total = headers.get("Content-Range", "").rpartition("/")[2].strip()
+    
+    return int(total) if total not in ["", "*"] else None
+
+
+def download_file(client, url, dest, progress, journal=None, chunk_size=download_chunk_size, scheduler=None):
+    """
+    Streams a file to disk in chunks.  The data is written to a temporary '.part' file 
+    which is renamed to the destination once the transfer completes and its size and 
+    digest (when provided by the server) are verified, so an interrupted download never 
+    leaves a truncated file under the final name.
+    
+    When a journal is provided, the '.part' file is kept after a failure and the next 
+    call continues from its last byte using an HTTP Range request.
+
+    Parameters
+    ----------
+    client : planet_client
+        Client used to retrieve the file.
+    url : str
+        Location of the file to download.
+    dest : str
+        Path where the file is saved.
+    progress : download_progress
+        Tracker updated as bytes are written.
+    journal : download_journal, optional
+        The default is None. Journal used to resume partial downloads.
+    chunk_size : int, optional
+        The default is download_chunk_size. Number of bytes written per iteration.
+    scheduler : download_scheduler, optional
+        The default is None. Scheduler capping the rate of the download.
+
+    Returns
+    -------
+    failed : dict
+        None if the file was downloaded, otherwise a description of the failure.
+
+    """
+    
+    item_basename = os.path.basename(dest)
+    part_file = dest + ".part"
+    entry = journal.get(item_basename) if journal != None else None
+    
+    # Resume only from a partial file whose expected size was journaled
+    offset = 0
+    if entry != None and entry.get("committed") == False and os.path.isfile(part_file):
+        offset = os.path.getsize(part_file)
+    
+    headers = {"Range": "bytes={}-".format(offset)} if offset > 0 else {}
+    
+    try:
+        # The delivery locations are signed URLs and are requested without the API key.
+        with client.get(url, authenticate=False, allow_redirects=True, stream=True, headers=headers) as r:
+            
+            if(r.status_code == 416 and offset > 0):
+                # The partial file already holds every byte; only verification is left.
+                size = entry.get("size")
+                md5 = entry.get("md5")
+                digest = file_md5(part_file)
+                
+            elif(r.status_code in [200, 206]):
+                
+                if r.status_code == 206:
+                    size = content_range_size(r.headers)
+                else:
+                    offset = 0
+                    size = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+                    
+                md5 = response_md5(r.headers)
+                
+                if offset > 0 and (size != entry.get("size") or md5 != entry.get("md5")):
+                    # The file changed on the server since the partial download, start over.
+                    r.close()
+                    os.remove(part_file)
+                    journal.remove(item_basename)
+                    return download_file(client, url, dest, progress, journal, chunk_size, scheduler)
+                
+                if journal != None:
+                    journal.record(item_basename, size=size, md5=md5, committed=False)
+                
+                digest = file_md5(part_file) if offset > 0 else hashlib.md5()
+                
+                progress.start(dest, size, offset)
+                
+                with open(part_file, "ab" if offset > 0 else "wb") as file1:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        file1.write(chunk)
+                        digest.update(chunk)
+                        progress.update(dest, len(chunk))
+                        
+                        if scheduler != None:
+                            scheduler.throttle(len(chunk))
+                        
+            else:
+                try:
+                    message = r.json()
+                except ValueError:
+                    message = r.text
+                    
+                return {"filename": item_basename, "status_code": r.status_code, "message": message}
+        
+        # Verify the file before committing it under its final name
+        if (size != None and os.path.getsize(part_file) != size) or \
+           (md5 != None and base64.b64encode(digest.digest()).decode() != md5):
+            os.remove(part_file)
+            
+            if journal != None:
+                journal.remove(item_basename)
+                
+            return {"filename": item_basename, "status_code": r.status_code, "message": "Size or MD5 digest verification failed."}
+                    
+        os.replace(part_file, dest)
+        
+        if journal != None:
+            journal.record(item_basename, committed=True)
+        
+    except (requests.exceptions.RequestException, OSError, ValueError) as e:
+        # ValueError: malformed size header, only this file fails
+        if journal == None and os.path.isfile(part_file):
+            os.remove(part_file)
+            
+        return {"filename": item_basename, "status_code": None, "message": str(e)}
+    
+    return None
+
+
+def file_md5(path, chunk_size=download_chunk_size):
+    """
+    Returns a hashlib MD5 object updated with the content of the file at path.
+    """
+    
+    digest = hashlib.md5()
+    
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    
+    return digest
+    
+
+def get_data(order_list, output_dir, workers=download_workers, resume=False, selection=None, dry_run=False, postprocess=None, store=None, 
+             scheduler=None, priority="order"):
+    """
+    Downloads the files of the orders.
+
+    Parameters
+    ----------
+    order_list : list
+        Orders to download.
+    output_dir : str
+        Directory where the files are saved.
+    workers : int, optional
+        The default is download_workers. Number of files downloaded at the same time.
+    resume : bool, optional
+        The default is False. Keep partial downloads and continue them on the next run.
+    selection : file_selection, optional
+        The default is None, which downloads all the files of the orders.
+    dry_run : bool, optional
+        The default is False. Only print the number and size of the files that would be 
+        downloaded.
+    postprocess : str, optional
+        The default is None. Name of the post_processor sink, 'cog', 'gzip' or 'zip', the 
+        downloaded files are written to while the next files are downloaded.
+    store : asset_store, optional
+        The default is None. Store of the files already downloaded for any site or order, 
+        files found in it are linked instead of downloaded.
+    scheduler : download_scheduler, optional
+        The default is None, no limit on the bandwidth and connections per host.
+    priority : str, optional
+        The default is 'order'. One of download_scheduler.priorities, the order in which 
+        the files of the orders are downloaded.
+
+    Returns
+    -------
+    summary : dict
+        Download counts of each order, empty in a dry run.
+
+    """
     
-    print(" --- DOWNLOADING DATA ----")
+    print(" --- DOWNLOADING DATA ----" if dry_run == False else " --- FILES TO DOWNLOAD ----")
     summary = {}
-
-    PLANET_API_KEY = os.getenv('PL_API_KEY')
+    dry_run_bytes = 0
     
     
-    if not os.path.exists(output_dir):
+    if not os.path.exists(output_dir) and dry_run == False:
         try:
             print("\n\nNOTE: Output directory '{}' does not exist.  Creating directory.".format(output_dir))
             os.makedirs(output_dir)
@@ -862,82 +3326,524 @@ def get_data(order_list, output_dir):
             if exc.errno != errno.EEXIST:
                 raise
     
-    with requests.Session() as session:
-        # Authenticate
-        session.auth = (PLANET_API_KEY, "")
+    # In resume mode partial files are kept and their expected size and digest journaled
+    journal = download_journal(output_dir) if resume == True else None
+    
+    if scheduler == None:
+        scheduler = download_scheduler()
+    
+    # Converts the downloaded files in other processes while the next files download
+    processor = post_processor(postprocess, output_dir) if postprocess != None and dry_run == False else None
+    
+    def fetch(links, dest, progress, key=None):
+        # Download a single file.  Rate limits and server errors are retried by the client.
+        name = os.path.basename(dest)
+        url = links.location(name)
+        
+        with scheduler.connection(url):
+            failed = download_file(get_client(), url, dest, progress, journal, scheduler=scheduler)
+            
+            if failed != None and failed["status_code"] in order_links.expired_status:
+                # The signed location expired while waiting in the queue, retry with a fresh one
+                fresh_url = links.refresh(name, url)
+                
+                if fresh_url != url:
+                    failed = download_file(get_client(), fresh_url, dest, progress, journal, scheduler=scheduler)
+            
+        progress.finish(dest, failed == None)
+        
+        if failed != None:
+            print('\nERROR: File {} not downloaded. Status code {}\n'.format(failed["filename"], failed["status_code"]))
+        else:
+            if store != None and key != None:
+                store.add(dest, key)
+                
+            if processor != None:
+                processor.submit(dest)
+            
+        return failed
+    
+    # Size the connection pool so each worker can keep its connection alive.
+    get_client().ensure_pool_size(workers + 1)
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
         
         order_num=1
+        pending = []
+        queued = set()
         
         for order in order_list:
             url = order["_links"]["_self"]
             order_name = order["name"]
             order_id = order["id"]
             
-            print("Downloading order {} ({} of {}).".format(order_name, order_num, len(order_list)))
+            print("{} order {} ({} of {}).".format("Downloading" if dry_run == False else "Checking", order_name, order_num, len(order_list)))
             print("Saving files to: {}".format(output_dir))
-            r = session.get(url)
+            r = get_client().get(url)
             if(r.status_code != 200):
                 print("\n Failed to retrieve order {}. Status code: {}....Skipping".format(order_name, r.status_code))
                 continue
             
             response = r.json()
             
-            files_available = [os.path.basename(r['name']) for r in response['_links']['results']]
-            need_to_download = [item for item in files_available if os.path.isfile(os.path.join(output_dir, item)) == False]
+            results = response['_links']['results']
+            
+            if selection != None:
+                results = [x for x in results if selection.selected(os.path.basename(x['name']))]
+            
+            excluded_count = len(response['_links']['results']) - len(results)
+            files_available = [os.path.basename(r['name']) for r in results]
+            
+            if journal != None:
+                need_to_download = [item for item in files_available if journal.is_complete(item, os.path.join(output_dir, item)) == False]
+            else:
+                need_to_download = [item for item in files_available if os.path.isfile(os.path.join(output_dir, item)) == False]
+            
+            # Orders saved to the same directory share file names such as manifest.json, 
+            # a file queued by an earlier order is counted as downloaded.
+            need_to_download = [item for item in need_to_download if item not in queued]
+            queued.update(need_to_download)
+            
+            keys = {}
+            linked_count = 0
+            
+            if store != None or priority == "smallest":
+                # The manifest delivered with the order lists the item, asset, digest and size of each file
+                keys = manifest_keys(response['_links']['results'])
+            
+            if store != None:
+                # Files downloaded before for another site or order are linked from the store
+                if dry_run == False:
+                    # Files downloaded before the store was used are added to it
+                    for item in files_available:
+                        if item in keys and item not in need_to_download and store.lookup(keys[item]) == None:
+                            store.add(os.path.join(output_dir, item), keys[item])
+                
+                found = [x for x in need_to_download if x in keys and store.lookup(keys[x]) != None]
+                
+                if dry_run == False:
+                    found = [x for x in found if store.link(store.lookup(keys[x]), os.path.join(output_dir, x))]
+                
+                linked_count = len(found)
+                found = set(found)
+                need_to_download = [x for x in need_to_download if x not in found]
 
-            failed_count = 0
             skipped_count = len(files_available) - len(need_to_download)
-            success_count = 0 + skipped_count
-            failed_files =[]
             
-            if len(need_to_download) == 0:
-                print("All files already downloaded, skipping this order.\n")
-                order_num += 1
+            if dry_run == True:
+                # Ask for the size of each file without downloading it
+                needed = set(need_to_download)
+                sizes = list(executor.map(remote_size, [x["location"] for x in results if os.path.basename(x["name"]) in needed]))
+                order_bytes = sum([x for x in sizes if x != None])
+                dry_run_bytes += order_bytes
                 
-            else:
-                for item in response['_links']['results']:
-                    
-                    item_basename = os.path.basename(item["name"])
-                    dest = os.path.join(output_dir, item_basename)
-                    url = item["location"]
-                    
-                    if item_basename not in need_to_download:
-                        continue
-                    
-                    #site.__write_log__('downloading {} to {}'.format(item_basename, dest, url))
-                    
-                    r = requests.get(url, allow_redirects=True)
-                    
-                    if(r.status_code == 200):
-                        with open(dest, "wb") as file1:
-                            file1.write(r.content)
-                            success_count += 1
-                            
-                    else:
-                        print('\nERROR: File {} not downloaded. Status code {}\n'.format(r.status_code, item_basename))
-                        failed_count += 1
-                        json_r = r.json()
-                        failed_files.append({"filename": item_basename, "status_code": r.status_code, "message": json_r})
-                        time.sleep(3)
-                        
-                    output = "\rPending: {} Downloaded: {} Failed: {}".format(len(files_available)-success_count, success_count, failed_count)
-                    print("{:100}".format(output),  end='', flush=True) 
-                    
+                print("{} files selected, {} excluded, {} already downloaded{}.".format(len(files_available), excluded_count, skipped_count - linked_count, 
+                                                                                  ", {} in the asset store".format(linked_count) if store != None else ""))
+                print("{} files to download, {}{}\n".format(len(need_to_download), format_size(order_bytes), 
+                                                            " (size of {} files unknown)".format(sizes.count(None)) if None in sizes else ""))
+                order_num += 1
+                continue
             
-            print("DONE with order {}\n\n".format(order_name))
+            if processor != None:
+                # Files downloaded by an earlier run that have not been converted yet
+                for item in files_available:
+                    if item not in need_to_download:
+                        processor.submit(os.path.join(output_dir, item))
+            
+            if linked_count > 0:
+                print("{} files linked from the asset store {}.".format(linked_count, store.path))
+            
+            if len(need_to_download) == 0:
+                print("All files already downloaded, skipping this order.\n")
             
+            needed = set(need_to_download)
+            files = [x for x in results if os.path.basename(x["name"]) in needed]
             
+            pending.append({"name": order_name, "id": order_id, "num": order_num, "files": files, "keys": keys, "available": files_available, "links": order_links(url, response),
+                            "skipped": skipped_count, "excluded": excluded_count, "linked": linked_count, "jobs": []})
             order_num += 1
-            json_file = os.path.join(output_dir, "{}.json".format(order_name))
-            summary[order_name] = {"failed" : failed_count, "skipped":skipped_count, "success": success_count, "order_id": order_id, "failed_files":failed_files, "json": json_file}
+        
+        # One progress line for the files of all the orders
+        progress = download_progress(sum([len(x["available"]) for x in pending]), sum([x["skipped"] for x in pending]))
+        files = []
+        
+        for order in pending:
+            for index, item in enumerate(order["files"]):
+                key = order["keys"].get(os.path.basename(item["name"]))
+                files.append((order["num"], index, key[3] if key != None else None, order, item))
+                progress.expect(os.path.join(output_dir, os.path.basename(item["name"])), files[-1][2])
+        
+        # The executor starts the files in the order they are submitted
+        for num, index, size, order, item in scheduler.queue(files, priority):
+            item_basename = os.path.basename(item["name"])
+            dest = os.path.join(output_dir, item_basename)
+            order["jobs"].append(executor.submit(fetch, order["links"], dest, progress, order["keys"].get(item_basename)))
+        
+        for order in pending:
+            
+            # Wait for all the files of this order before writing its summary
+            failed_files = [x for x in [job.result() for job in order["jobs"]] if x != None]
+            
+            if processor != None:
+                processor.finish_order(order["name"], [os.path.join(output_dir, x) for x in order["available"]], len(order["jobs"]) > 0)
+            
+            if len(order["jobs"]) > 0:
+                print("")
+            
+            print("DONE with order {}\n\n".format(order["name"]))
+            
+            json_file = os.path.join(output_dir, "{}.json".format(order["name"]))
+            summary[order["name"]] = {"failed" : len(failed_files), "skipped": order["skipped"], "excluded": order["excluded"], "linked": order["linked"], 
+                                      "success": order["skipped"] + len(order["jobs"]) - len(failed_files), "order_id": order["id"], "failed_files":failed_files, "json": json_file}
             
             with open(json_file, "w") as download_stats_json:
                 json.dump(summary, download_stats_json, indent=4, sort_keys=True)
                 
-            
+    if dry_run == True:
+        print("Total size to download to {}: {}\n".format(output_dir, format_size(dry_run_bytes)))
+    
+    if processor != None:
+        processor.close()
+    
     return summary
 
 
+class order_links:
+    """
+    Delivery locations of the files of an order.  The locations are signed URLs that 
+    expire, so on large orders the last files are reached after their location expired.  
+    When a location expires, or is rejected by the storage server, the order is retrieved 
+    again in a single call and every file of the order continues with the fresh locations.
+    """
+    
+    expiry_margin = 60    # Seconds before its expiry time a location is considered expired
+    expired_status = [400, 401, 403]    # Status codes returned by the storage server for an expired location
+    
+    def __init__(self, url, response):
+        self.url = url
+        self.lock = threading.Lock()
+        self.refreshed = 0
+        self.items = {}
+        self.__update__(response)
+    
+    def location(self, name):
+        """
+        Returns the location of the file name, after retrieving the order again if the 
+        location is about to expire.
+        """
+        
+        with self.lock:
+            item = self.items[name]
+            
+            # Do not retrieve the order again right away if the fresh locations expire as soon
+            if self.__expired__(item) and time.monotonic() - self.refreshed > self.expiry_margin:
+                self.__refresh__()
+            
+            return self.items[name]["location"]
+    
+    def refresh(self, name, stale):
+        """
+        Returns a fresh location for the file name, whose location stale was rejected.  
+        The order is only retrieved again if no other file refreshed it since stale was 
+        handed out.
+        """
+        
+        with self.lock:
+            if self.items[name]["location"] == stale:
+                self.__refresh__()
+            
+            return self.items[name]["location"]
+    
+    def __expired__(self, item):
+        if item.get("expires_at") == None:
+            return False
+        
+        try:
+            expires = parse_timestamp(item["expires_at"]).timestamp()
+        except ValueError:
+            return False
+        
+        return expires - time.time() < self.expiry_margin
+    
+    def __refresh__(self):
+        self.refreshed = time.monotonic()
+        r = get_client().get(self.url)
+        
+        if(r.status_code == 200):
+            self.__update__(r.json())
+        else:
+            print("\nWARNING: Failed to refresh the download locations of order {}. Status code: {}".format(self.url, r.status_code))
+    
+    def __update__(self, response):
+        self.items.update({os.path.basename(x["name"]): x for x in response["_links"].get("results", [])})
+
+
+class asset_store:
+    """
+    Content addressed store of the downloaded files, shared by all the sites and orders.
+    Each file is kept once under its MD5 digest and indexed by item ID, asset type and 
+    digest in a SQLite database, so a file already downloaded for another site or order 
+    is hard linked into the order directory instead of downloaded again.  The store 
+    should be on the same file system as the output directories, otherwise the files 
+    are copied.
+    """
+    
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, "assets.sqlite"), check_same_thread=False)
+        
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS assets (item_id TEXT, asset_type TEXT, md5 TEXT, size INTEGER, path TEXT, PRIMARY KEY (item_id, asset_type, md5))")
+    
+    def lookup(self, key):
+        """
+        Returns the path of the stored file of key (item_id, asset_type, md5, size), or 
+        None if the file is not in the store.
+        """
+        
+        with self.lock:
+            row = self.db.execute("SELECT path FROM assets WHERE item_id = ? AND asset_type = ? AND md5 = ?", key[:3]).fetchone()
+        
+        if row == None:
+            return None
+        
+        path = os.path.join(self.path, row[0])
+        
+        if os.path.isfile(path) == False or (key[3] != None and os.path.getsize(path) != key[3]):
+            return None
+        
+        return path
+    
+    def add(self, path, key):
+        """
+        Adds a downloaded file to the store under key (item_id, asset_type, md5, size).
+        """
+        
+        name = os.path.join("objects", key[2][:2], key[2])
+        
+        if os.path.isfile(os.path.join(self.path, name)) == False and self.link(path, os.path.join(self.path, name)) == False:
+            return
+        
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?)", key[:3] + (os.path.getsize(path), name))
+    
+    def link(self, src, dest):
+        """
+        Hard links src to dest, or copies it when both are not on the same file system.
+        Returns False if the file could not be linked or copied.
+        """
+        
+        part = dest + ".part"
+        
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            
+            try:
+                os.link(src, part)
+            except OSError:
+                shutil.copyfile(src, part)
+                
+            os.replace(part, dest)
+            
+        except OSError as e:
+            print("\nWARNING: Could not link {} to {}: {}".format(src, dest, e))
+            return False
+        
+        return True
+
+
+def manifest_keys(results):
+    """
+    Returns the asset_store key (item_id, asset_type, md5, size) of the files of an 
+    order, by file name, from the manifest.json file delivered with the order.  The 
+    manifest is always retrieved from the order's own location: the chunks of an order 
+    are saved to the same directory, so a manifest.json on disk may belong to another 
+    chunk.
+    """
+    
+    manifest = None
+    
+    for item in results:
+        if os.path.basename(item["name"]) != "manifest.json":
+            continue
+        
+        try:
+            r = get_client().get(item["location"], authenticate=False, allow_redirects=True)
+            manifest = r.json() if r.status_code == 200 else None
+        except (ValueError, requests.exceptions.RequestException):
+            manifest = None
+    
+    keys = {}
+    
+    for entry in (manifest or {}).get("files", []):
+        annotations = entry.get("annotations", {})
+        md5 = entry.get("digests", {}).get("md5")
+        
+        if md5 == None or "planet/item_id" not in annotations:
+            continue
+        
+        keys[os.path.basename(entry["path"])] = (annotations["planet/item_id"], annotations.get("planet/asset_type", ""), md5, entry.get("size"))
+    
+    return keys
+
+
+class post_processor:
+    """
+    Writes the downloaded files to a sink in a pool of processes, so the CPU bound 
+    conversion of a file overlaps the download of the next files.  The sinks are:
+        
+        cog  : each GeoTIFF is converted to a tiled, compressed Cloud Optimized GeoTIFF 
+               in output_dir/cog, other files are not converted.  Needs GDAL.
+        gzip : each file is compressed to output_dir/gzip/<file name>.gz
+        zip  : the files of each order are archived to output_dir/zip/<order name>.zip 
+               once all the files of the order are downloaded.
+    
+    The downloaded files are kept, so the next runs still skip them, and the files 
+    already written to the sink are not converted again.
+    """
+    
+    sinks = ["cog", "gzip", "zip"]
+    
+    def __init__(self, sink, output_dir, workers=postprocess_workers):
+        if sink not in self.sinks:
+            raise Exception("Unknown post-processing '{}', use one of {}.".format(sink, ", ".join(self.sinks)))
+        
+        if sink == "cog":
+            try:
+                from osgeo import gdal
+            except ImportError:
+                raise Exception("The cog post-processing needs the GDAL Python bindings, e.g. 'conda install -c conda-forge gdal'.")
+            
+            if gdal.GetDriverByName("COG") == None:
+                raise Exception("The cog post-processing needs GDAL 3.1 or newer.")
+        
+        self.sink = sink
+        self.sink_dir = os.path.join(output_dir, sink)
+        os.makedirs(self.sink_dir, exist_ok=True)
+        
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.jobs = []
+        self.lock = threading.Lock()
+        
+    def submit(self, path):
+        # Zip archives are written once all the files of the order are downloaded
+        if self.sink == "zip" or (self.sink == "cog" and path.lower().endswith((".tif", ".tiff")) == False):
+            return
+        
+        name = os.path.basename(path) + (".gz" if self.sink == "gzip" else "")
+        dest = os.path.join(self.sink_dir, name)
+        
+        if os.path.isfile(dest) == False:
+            with self.lock:
+                self.jobs.append((os.path.basename(path), self.pool.submit(write_sink, self.sink, [path], dest)))
+                
+    def finish_order(self, order_name, paths, updated):
+        if self.sink != "zip":
+            return
+        
+        dest = os.path.join(self.sink_dir, "{}.zip".format(order_name))
+        paths = [x for x in paths if os.path.isfile(x)]
+        
+        if len(paths) > 0 and (updated == True or os.path.isfile(dest) == False):
+            with self.lock:
+                self.jobs.append((os.path.basename(dest), self.pool.submit(write_sink, self.sink, paths, dest)))
+        
+    def close(self):
+        failed = 0
+        
+        for name, job in self.jobs:
+            try:
+                job.result()
+            except Exception as e:
+                failed += 1
+                print("ERROR: Post-processing of {} failed: {}".format(name, e))
+        
+        self.pool.shutdown()
+        print("Post-processed {} files to {}, {} failed.\n".format(len(self.jobs) - failed, self.sink_dir, failed))
+
+
+def write_sink(sink, sources, dest):
+    """
+    Writes the source files to a post_processor sink.  Runs in the process pool of 
+    the post_processor, the output is written to a temporary file first so an 
+    interrupted conversion is not mistaken for a finished one.
+    """
+    
+    part = dest + ".part"
+    
+    if sink == "cog":
+        from osgeo import gdal
+        gdal.UseExceptions()
+        gdal.Translate(part, sources[0], format="COG", creationOptions=["COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=IF_SAFER"])
+        
+    elif sink == "gzip":
+        with open(sources[0], "rb") as src, gzip.open(part, "wb") as out:
+            shutil.copyfileobj(src, out, download_chunk_size)
+            
+    elif sink == "zip":
+        with zipfile.ZipFile(part, "w", zipfile.ZIP_DEFLATED) as archive:
+            for source in sources:
+                archive.write(source, os.path.basename(source))
+    
+    os.replace(part, dest)
+
+
+class file_selection:
+    """
+    Selects the files of an order to download by their name.  A file is selected when 
+    it matches one of the include glob patterns, if any are given, and none of the 
+    exclude patterns, e.g. include=["*_AnalyticMS_SR*.tif"].
+    """
+    
+    def __init__(self, include=None, exclude=None):
+        self.include = include if include != None else []
+        self.exclude = exclude if exclude != None else []
+    
+    def selected(self, name):
+        if len(self.include) > 0 and any([fnmatch.fnmatch(name, x) for x in self.include]) == False:
+            return False
+        
+        return any([fnmatch.fnmatch(name, x) for x in self.exclude]) == False
+
+
+def remote_size(url):
+    """
+    Returns the size in bytes of an order file, or None if it is unknown.  Only the 
+    first byte of the file is requested, the size is read from the Content-Range 
+    header, or from Content-Length if the server ignores the Range header.
+    """
+    
+    try:
+        with get_client().get(url, authenticate=False, allow_redirects=True, stream=True, headers={"Range": "bytes=0-0"}) as r:
+            if r.status_code == 206:
+                return content_range_size(r.headers)
+            
+            if(r.status_code != 200 or "content-length" not in r.headers):
+                return None
+            
+            return int(r.headers["content-length"])
+        
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def format_size(nbytes):
+    """
+    Returns a number of bytes as a human readable string, e.g. '1.5 GB'.
+    """
+    
+    for unit in ["B", "KB", "MB", "GB"]:
+        if nbytes < 1000:
+            return "{:.1f} {}".format(nbytes, unit)
+        
+        nbytes = nbytes / 1000
+    
+    return "{:.1f} TB".format(nbytes)
+
+
 
 def print_download_summary(summary, output_dir):
     
@@ -957,14 +3863,27 @@ def download(output_dir,
              min_year = None,
              max_year = None,
              geometry_path = None, 
-             prefix=None
+             prefix=None,
+             workers=download_workers,
+             resume=False,
+             orders=None,
+             full_sync=False,
+             selection=None,
+             dry_run=False,
+             postprocess=None,
+             store=None,
+             scheduler=None,
+             priority="order"
             ):
     
     check_base_server() 
     prefix = prefix + "_" if prefix != None else ""
     
-    # Check if output directory exists
-    if not os.path.exists(output_dir):
+    if orders == None:
+        orders = order_index()
+    
+    # Check if output directory exists, a dry run leaves the disk untouched
+    if not os.path.exists(output_dir) and dry_run == False:
         try:
             print("NOTE: Output directory '{}' does not exist.  Creating directory.".format(output_dir))
             os.makedirs(output_dir)
@@ -978,6 +3897,10 @@ def download(output_dir,
         
         json_files = get_gjson_filelist(geometry_path)
         
+        # Retrieve the order list once, each site then looks up its orders by name
+        snapshot = order_snapshot(orders.synced(order_url, full=full_sync).query())
+        date_search = parse_order_date(order_date_search)
+        
         aoi_list = [aoi(geom_path = site, 
                         min_year = min_year,
                         max_year = max_year
@@ -992,7 +3915,7 @@ def download(output_dir,
             print("   SUMMARY FOR ORDER: {}".format(order_name))
             print("###########################################################")
             
-            if not os.path.exists(output_site_dir):
+            if not os.path.exists(output_site_dir) and dry_run == False:
                 try:
                     print("NOTE: Site directory '{}' does not exist.  Creating directory.".format(output_site_dir))
                     os.makedirs(output_site_dir)
@@ -1000,7 +3923,8 @@ def download(output_dir,
                     if exc.errno != errno.EEXIST:
                         raise
             
-            order_list = check( order_name_search=order_name+ "*", 
+            order_list = summarize_orders(snapshot.named(order_name, date_search), 
+                   order_name_search=order_name + "*",
                    order_date_search=order_date_search)
             
             if order_list == None:
@@ -1009,9 +3933,10 @@ def download(output_dir,
             
             site_output_dir = os.path.join(output_site_dir, order_name)
             
-            summary = get_data(order_list, site_output_dir)
-    
-            print_download_summary(summary, output_site_dir)
+            summary = get_data(order_list, site_output_dir, workers=workers, resume=resume, selection=selection, dry_run=dry_run, postprocess=postprocess, store=store, scheduler=scheduler, priority=priority)
+            
+            if dry_run == False:
+                print_download_summary(summary, output_site_dir)
     else:
          
         print("\n\n###########################################################")
@@ -1019,18 +3944,159 @@ def download(output_dir,
         print("###########################################################")
         
         order_list = check( order_name_search=order_name_search, 
-               order_date_search=order_date_search)
+               order_url=order_url,
+               order_date_search=order_date_search,
+               orders=orders,
+               full_sync=full_sync)
         
         if order_list == None:
             print("No succesful orders to download.")
         
-        summary = get_data(order_list, output_dir)
-
-        print_download_summary(summary, output_dir)
+        summary = get_data(order_list, output_dir, workers=workers, resume=resume, selection=selection, dry_run=dry_run, postprocess=postprocess, store=store, scheduler=scheduler, priority=priority)
         
+        if dry_run == False:
+            print_download_summary(summary, output_dir)
+
+
+def watch(output_dir, 
+          order_url=orders_url, 
+          order_name_search=None, 
+          order_date_search=None,
+          min_year = None,
+          max_year = None,
+          geometry_path = None, 
+          prefix=None,
+          workers=download_workers,
+          resume=False,
+          orders=None,
+          min_interval=watch_min_interval,
+          max_interval=watch_max_interval,
+          selection=None,
+          postprocess=None,
+          store=None,
+          scheduler=None,
+          priority="order"
+         ):
+    """
+    Polls the orders that are still being processed by Planet and downloads each order 
+    as soon as it is ready, while the other orders are still being processed.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory where the files are saved.  When geometry_path is given, the files of 
+        each site are saved in output_dir/site/order_name as with the download command.
+    min_interval : float, optional
+        The default is watch_min_interval. Seconds between polls after an order changed state.
+    max_interval : float, optional
+        The default is watch_max_interval. The interval grows up to this number of seconds 
+        while no order changes state.
+    
+    See the download command for the other parameters.
+
+    Returns
+    -------
+    None.
 
+    """
+    
+    check_base_server() 
+    prefix = prefix + "_" if prefix != None else ""
+    
+    if orders == None:
+        orders = order_index()
+    
+    # Directory of each site's orders, keyed by the order name built by const_order_name
+    site_dirs = None
+    s_order_names = None
+    
+    if geometry_path != None:
+        site_dirs = {}
+        
+        for jfile in get_gjson_filelist(geometry_path):
+            site_name = os.path.splitext(os.path.basename(jfile))[0]
+            order_name = const_order_name(prefix, site_name, min_year, max_year)
+            site_dirs[order_name] = os.path.join(output_dir, site_name, order_name)
+            
+        s_order_names = [x + "*" for x in site_dirs.keys()]
+    
+    def order_dir(order):
+        if site_dirs == None:
+            return output_dir
+        
+        return site_dirs[order_base_name(order["name"])]
+    
+    
+    filtered_olist = orders.synced(order_url).query(date_search=parse_order_date(order_date_search),
+                                                    name_search=order_name_search,
+                                                    const_oname_list=s_order_names)
+    
+    if site_dirs != None:
+        # The name patterns also match other orders starting with a site's order name, 
+        # e.g. '<order name>_v2_chunk_0', keep the orders of the sites as download does
+        filtered_olist = [x for x in filtered_olist if order_base_name(x["name"]) in site_dirs]
+    
+    summarize_orders(filtered_olist, order_name_search, order_date_search)
+    
+    pending = [x for x in filtered_olist if x["state"] not in order_index.terminal_states]
+    ready = [x for x in filtered_olist if x["state"] in ['success', 'partial']]
+    summaries = {}
+    
+    # A single download thread, so the console output of one order is not mixed with 
+    # another.  Each order still downloads its files with several workers.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        
+        def start_download(order):
+            print("{}: Order {} is {}, queued for download.".format(dt.now(), order["name"], order["state"]))
+            dest = order_dir(order)
+            summaries.setdefault(dest, []).append(executor.submit(get_data, [order], dest, workers, resume, selection, postprocess=postprocess, store=store, 
+                                                                    scheduler=scheduler, priority=priority))
+        
+        for order in ready:
+            start_download(order)
+        
+        interval = min_interval
+        
+        while len(pending) > 0:
+            print("{}: Waiting for {} orders, next check in {:.0f} seconds.".format(dt.now(), len(pending), interval))
+            time.sleep(interval)
+            
+            still_pending = []
+            changed = False
+            
+            for order in pending:
+                response = get_client().get(order["_links"]["_self"])
+                
+                if(response.status_code != 200):
+                    still_pending.append(order)
+                    continue
+                
+                current = response.json()
+                orders.update([current])
+                
+                if current["state"] != order["state"]:
+                    changed = True
+                
+                if current["state"] in ['success', 'partial']:
+                    start_download(current)
+                elif current["state"] in order_index.terminal_states:
+                    print("{}: Order {} is {}: {}".format(dt.now(), current["name"], current["state"], current["last_message"]))
+                else:
+                    still_pending.append(current)
             
+            pending = still_pending
             
+            # Poll again soon after a change, otherwise back off
+            interval = min_interval if changed else min(max_interval, interval * 1.5)
+    
+    for dest, jobs in summaries.items():
+        summary = {}
+        
+        for job in jobs:
+            summary.update(job.result())
+        
+        print_download_summary(summary, dest)
+
 
 
 
@@ -1038,6 +4104,8 @@ if __name__ == "__main__":
     
     import argparse
     parser = argparse.ArgumentParser()
+    parser.add_argument("--timeout", help="Seconds to wait for a response from the Planet servers before retrying.", type=float, default=api_timeout)
+    parser.add_argument("--retries", help="Number of times a rate limited or failed request to the Planet servers is retried.", type=int, default=api_retries)
 
     subparser = parser.add_subparsers(dest="command", required=True)
     
@@ -1046,11 +4114,36 @@ if __name__ == "__main__":
     parser_search.add_argument("-min_c", "--min_cloud", help="Minimum Cloud Cover in Percent.", type=float,  default=0.0)
     parser_search.add_argument("-max_c", "--max_cloud", help="Maximum Cloud Cover in Percent.", type=float,  default=0.50)
     parser_search.add_argument("-p", "--permission", help="Show results for items you account allows to download.", default=True, action=argparse.BooleanOptionalAction)
+    parser_search.add_argument("-w", "--workers", help="Number of sites to search at the same time.", type=int, default=search_workers)
+    parser_search.add_argument("--cache", help="Reuse recent search results stored on disk.", default=True, action=argparse.BooleanOptionalAction)
+    parser_search.add_argument("--cache_dir", help="Directory where search results and the item type and asset type definitions are cached.", type=str, default=cache_dir)
+    parser_search.add_argument("--cache_ttl", help="Hours a cached search result is reused.", type=float, default=cache_ttl)
+    parser_search.add_argument("--cache_max_mb", help="Maximum size of the search cache in MB.", type=float, default=cache_max_mb)
+    parser_search.add_argument("--incremental", help="Only ask Planet for items published since the previous incremental search of each site and merge them with its results.", default=False, action=argparse.BooleanOptionalAction)
+    parser_search.add_argument("--tiles", help="Split each AOI in a grid of N x N tiles searched at the same time, for large AOIs.", type=int, default=1)
+    parser_search.add_argument("--part_workers", help="Number of tiles, periods or footprint cells of each site searched at the same time.", type=int, default=search_part_workers)
+    parser_search.add_argument("--footprints", help="Answer searches from a local index of the items found by previous --footprints searches, only asking Planet for the parts of each AOI not searched recently.", default=False, action=argparse.BooleanOptionalAction)
+    parser_search.add_argument("--shard", help="Split the year range in periods searched at the same time, for long year ranges.", type=str, choices=["year", "quarter", "month"], default=None)
+    parser_search.add_argument("--batch", help="Search up to N nearby sites with a single request, for many small sites.", type=int, default=1)
+    parser_search.add_argument("--features_dir", help="Save the features found for each site to <site name>.ndjson in this directory.", type=str, default=None)
     parser_search.add_argument("min_year", help="Starting year of interest, YYYY format", type=int)
     parser_search.add_argument("max_year", help="Ending year of interest, YYYY format", type=int)
     parser_search.add_argument("geojson_files", help="Path to directory containing GeoJSON Files representing Area of Interest", type=str)
 
     
+    parser_estimate = subparser.add_parser('estimate', help='Count the items available without retrieving them.')
+    
+    parser_estimate.add_argument("-min_c", "--min_cloud", help="Minimum Cloud Cover in Percent.", type=float,  default=0.0)
+    parser_estimate.add_argument("-max_c", "--max_cloud", help="Maximum Cloud Cover in Percent.", type=float,  default=0.50)
+    parser_estimate.add_argument("-p", "--permission", help="Count items you account allows to download.", default=True, action=argparse.BooleanOptionalAction)
+    parser_estimate.add_argument("-item", "--api_item_type", help="Planet item type to count, e.g. the item type you plan to order.  All item types are counted by default.", type=str, default=None)
+    parser_estimate.add_argument("--interval", help="Length of the periods counted.", type=str, choices=["hour", "day", "week", "month", "year"], default="year")
+    parser_estimate.add_argument("-w", "--workers", help="Number of sites counted at the same time.", type=int, default=search_workers)
+    parser_estimate.add_argument("min_year", help="Starting year of interest, YYYY format", type=int)
+    parser_estimate.add_argument("max_year", help="Ending year of interest, YYYY format", type=int)
+    parser_estimate.add_argument("geojson_files", help="Path to directory containing GeoJSON Files representing Area of Interest", type=str)
+
+    
     subparser_order = subparser.add_parser("order", help='Place the order.')
 
     subparser_order.add_argument("-min_c", "--min_cloud", help="Minimum Cloud Cover in Percent.", type=float,  default=0.00)
@@ -1059,6 +4152,19 @@ if __name__ == "__main__":
     subparser_order.add_argument("-bundle", "--api_product_bundle", help="Planet bundle names used for placing orders.", type=str, default="analytic_udm2")
     subparser_order.add_argument("-prefix", "--order_name_prefix", help="Add a prefix to the order name in order, to make it unique.", type=str)
     subparser_order.add_argument("--clip", action=argparse.BooleanOptionalAction, help="Enable or disable clip tool when ordering")
+    subparser_order.add_argument("--cache", help="Reuse recent search results stored on disk, e.g. from the search command.", default=True, action=argparse.BooleanOptionalAction)
+    subparser_order.add_argument("--cache_dir", help="Directory where search results are cached.", type=str, default=cache_dir)
+    subparser_order.add_argument("--cache_ttl", help="Hours a cached search result is reused.", type=float, default=cache_ttl)
+    subparser_order.add_argument("--cache_max_mb", help="Maximum size of the search cache in MB.", type=float, default=cache_max_mb)
+    subparser_order.add_argument("--tiles", help="Split each AOI in a grid of N x N tiles searched at the same time, for large AOIs.", type=int, default=1)
+    subparser_order.add_argument("--part_workers", help="Number of tiles, periods or footprint cells of each site searched at the same time.", type=int, default=search_part_workers)
+    subparser_order.add_argument("--footprints", help="Answer searches from a local index of the items found by previous --footprints searches, only asking Planet for the parts of each AOI not searched recently.", default=False, action=argparse.BooleanOptionalAction)
+    subparser_order.add_argument("--shard", help="Split the year range in periods searched at the same time, for long year ranges.", type=str, choices=["year", "quarter", "month"], default=None)
+    subparser_order.add_argument("--chunk_items", help="Maximum number of items per order chunk.", type=int, default=order_chunk_size)
+    subparser_order.add_argument("--chunk_mb", help="Maximum estimated delivery size of an order chunk in MB.", type=float, default=None)
+    subparser_order.add_argument("--item_mb", help="Estimated delivery size of an item in MB, used with --chunk_mb.  A rough size per item type is used by default.", type=float, default=None)
+    subparser_order.add_argument("--max_in_flight", help="Number of order chunks submitted at the same time.", type=int, default=order_in_flight)
+    subparser_order.add_argument("--manifest", help="File recording the item IDs, and the order ID or error, of each chunk, one JSON object per line.  Running the command again with the same manifest resubmits the chunks that were not accepted.", type=str, default="psites_order_manifest.ndjson")
     subparser_order.add_argument("min_year", help="Starting year of interest, YYYY format", type=int)
     subparser_order.add_argument("max_year", help="Ending year of interest, YYYY format", type=int)
     subparser_order.add_argument("geojson_files", help="Path to directory containing GeoJSON Files representing Area of Interest", type=str)
@@ -1070,6 +4176,8 @@ if __name__ == "__main__":
     subparser_check.add_argument("-oname", "--order_name", help="Filter results by order name. Use '*' as wildcard, e.g. Boston* or *2016_2017* ", type=str, default=None)
     subparser_check.add_argument("-odate", "--order_date", help="Filter results by order date, format YYYY-MM-DD.", type=str, default=None)
     subparser_check.add_argument("-prefix", "--order_name_prefix", help="Add a prefix to the order name in order, to make it unique.", type=str)
+    subparser_check.add_argument("--cache_dir", help="Directory where the local index of orders is kept.", type=str, default=cache_dir)
+    subparser_check.add_argument("--full_sync", help="Retrieve the whole order list instead of only the orders that are new or still being processed.", default=False, action=argparse.BooleanOptionalAction)
     
     
     subparser_download = subparser.add_parser("download", help='Check orders.')
@@ -1080,18 +4188,67 @@ if __name__ == "__main__":
     subparser_download.add_argument("-odate", "--order_date", help="Filter results by order date, format YYYY-MM-DD.", type=str, default=None)
     subparser_download.add_argument("output_dir", help="Directory where images are saved.", type=str)
     subparser_download.add_argument("-prefix", "--order_name_prefix", help="Add a prefix to the order name in order, to make it unique.", type=str)
+    subparser_download.add_argument("-w", "--workers", help="Number of files to download at the same time.", type=int, default=download_workers)
+    subparser_download.add_argument("--cache_dir", help="Directory where the local index of orders is kept.", type=str, default=cache_dir)
+    subparser_download.add_argument("--full_sync", help="Retrieve the whole order list instead of only the orders that are new or still being processed.", default=False, action=argparse.BooleanOptionalAction)
+    subparser_download.add_argument("--resume", help="Keep partial downloads and continue them from the last byte on the next run.", default=False, action=argparse.BooleanOptionalAction)
+    subparser_download.add_argument("--include", help="Only download files whose name matches this pattern, e.g. '*_AnalyticMS_SR*.tif'.  Can be given several times.", type=str, action="append", default=None)
+    subparser_download.add_argument("--dry_run", help="Only print the number and size of the files that would be downloaded.", default=False, action=argparse.BooleanOptionalAction)
+    subparser_download.add_argument("--postprocess", help="Also write the downloaded files to output_dir/<postprocess>: 'cog' converts GeoTIFFs to Cloud Optimized GeoTIFFs (needs GDAL), 'gzip' compresses each file, 'zip' archives each order.", type=str, choices=post_processor.sinks, default=None)
+    subparser_download.add_argument("--store", help="Directory of a store of the downloaded files shared by all sites and orders.  Files already in the store are hard linked instead of downloaded again.  Use a directory on the same file system as output_dir.", type=str, default=None)
+    subparser_download.add_argument("--max_rate", help="Cap the total download rate to this number of MB per second.", type=float, default=None)
+    subparser_download.add_argument("--host_connections", help="Maximum number of files downloaded from the same host at once.", type=int, default=None)
+    subparser_download.add_argument("--priority", help="Order in which files are downloaded: 'order' downloads one order at a time, 'round_robin' one file of each order in turn, 'smallest' the smallest files first.", type=str, choices=download_scheduler.priorities, default="order")
+    subparser_download.add_argument("--exclude", help="Do not download files whose name matches this pattern, e.g. '*.xml'.  Can be given several times.", type=str, action="append", default=None)
+    
+
+    subparser_watch = subparser.add_parser("watch", help='Wait for orders to be ready and download them as soon as they are.')
+    subparser_watch.add_argument("-gjson", "--geojson_files", help="Path to directory containing GeoJSON Files representing Area of Interest", type=str, default=None)
+    subparser_watch.add_argument("-min_y","--min_year", help="Starting year of interest, YYYY format", type=int, default=None)
+    subparser_watch.add_argument("-max_y", "--max_year", help="Ending year of interest, YYYY format", type=int, default=None)
+    subparser_watch.add_argument("-oname", "--order_name", help="Filter results by order name. Use '*' as wildcard, e.g. Boston* or *2016_2017* ", type=str, default=None)
+    subparser_watch.add_argument("-odate", "--order_date", help="Filter results by order date, format YYYY-MM-DD.", type=str, default=None)
+    subparser_watch.add_argument("output_dir", help="Directory where images are saved.", type=str)
+    subparser_watch.add_argument("-prefix", "--order_name_prefix", help="Add a prefix to the order name in order, to make it unique.", type=str)
+    subparser_watch.add_argument("-w", "--workers", help="Number of files to download at the same time.", type=int, default=download_workers)
+    subparser_watch.add_argument("--cache_dir", help="Directory where the local index of orders is kept.", type=str, default=cache_dir)
+    subparser_watch.add_argument("--resume", help="Keep partial downloads and continue them from the last byte on the next run.", default=False, action=argparse.BooleanOptionalAction)
+    subparser_watch.add_argument("--include", help="Only download files whose name matches this pattern, e.g. '*_AnalyticMS_SR*.tif'.  Can be given several times.", type=str, action="append", default=None)
+    subparser_watch.add_argument("--postprocess", help="Also write the downloaded files to output_dir/<postprocess>: 'cog' converts GeoTIFFs to Cloud Optimized GeoTIFFs (needs GDAL), 'gzip' compresses each file, 'zip' archives each order.", type=str, choices=post_processor.sinks, default=None)
+    subparser_watch.add_argument("--store", help="Directory of a store of the downloaded files shared by all sites and orders.  Files already in the store are hard linked instead of downloaded again.  Use a directory on the same file system as output_dir.", type=str, default=None)
+    subparser_watch.add_argument("--max_rate", help="Cap the total download rate to this number of MB per second.", type=float, default=None)
+    subparser_watch.add_argument("--host_connections", help="Maximum number of files downloaded from the same host at once.", type=int, default=None)
+    subparser_watch.add_argument("--priority", help="Order in which files are downloaded: 'order' downloads one order at a time, 'round_robin' one file of each order in turn, 'smallest' the smallest files first.", type=str, choices=download_scheduler.priorities, default="order")
+    subparser_watch.add_argument("--exclude", help="Do not download files whose name matches this pattern, e.g. '*.xml'.  Can be given several times.", type=str, action="append", default=None)
+    subparser_watch.add_argument("--min_interval", help="Seconds between checks of the orders after one of them changed state.", type=float, default=watch_min_interval)
+    subparser_watch.add_argument("--max_interval", help="Longest number of seconds between checks of the orders.", type=float, default=watch_max_interval)
     
 
     args = parser.parse_args()
     
+    configure_client(timeout=args.timeout, max_retries=args.retries)
+    
     if args.command == "search":
         
+        if(args.batch > 1 and (args.incremental or args.tiles > 1 or args.shard != None or args.footprints)):
+            raise Exception("The --batch flag can not be combined with --incremental, --tiles, --shard or --footprints.")
+        
         search(geometry_path = args.geojson_files,
              min_year = args.min_year,
              max_year = args.max_year,
              min_cloud = args.min_cloud,
              max_cloud = args.max_cloud,
-             allowed = args.permission
+             allowed = args.permission,
+             workers = args.workers,
+             cache = search_cache(args.cache_dir, args.cache_ttl, args.cache_max_mb) if args.cache else None,
+             history = search_history(args.cache_dir) if args.incremental else None,
+             features_dir = args.features_dir,
+             tiles = args.tiles,
+             shard = args.shard,
+             batch = args.batch,
+             footprints = footprint_index(args.cache_dir, args.cache_ttl) if args.footprints else None,
+             cache_dir = args.cache_dir if args.cache else None,
+             part_workers = args.part_workers
              )
         
         
@@ -1105,6 +4262,19 @@ if __name__ == "__main__":
         print("python {} order -bundle analytic_udm2 -item PSScene {} {} {}".format(os.path.basename(__file__), args.min_year, args.max_year, args.geojson_files))
           
 
+    elif args.command == "estimate":
+        
+        estimate(geometry_path = args.geojson_files,
+                 min_year = args.min_year,
+                 max_year = args.max_year,
+                 min_cloud = args.min_cloud,
+                 max_cloud = args.max_cloud,
+                 allowed = args.permission,
+                 item_types = [args.api_item_type] if args.api_item_type != None else default_item_type,
+                 interval = args.interval,
+                 workers = args.workers)
+        
+        
     elif args.command == "order":
         
         order(geometry_path = args.geojson_files,
@@ -1115,7 +4285,18 @@ if __name__ == "__main__":
               api_item_type = args.api_item_type,
               product_bundle = args.api_product_bundle,
               prefix = args.order_name_prefix, 
-              clip = args.clip
+              clip = args.clip,
+              cache = search_cache(args.cache_dir, args.cache_ttl, args.cache_max_mb) if args.cache else None,
+              orders = order_index(args.cache_dir),
+              manifest = order_manifest(args.manifest),
+              max_in_flight = args.max_in_flight,
+              tiles = args.tiles,
+              shard = args.shard,
+              footprints = footprint_index(args.cache_dir, args.cache_ttl) if args.footprints else None,
+              chunk_items = args.chunk_items,
+              chunk_mb = args.chunk_mb,
+              item_mb = args.item_mb,
+              part_workers = args.part_workers
               )
         
         prefix_flag =  "-prefix "+ args.order_name_prefix  if args.order_name_prefix != None else ""
@@ -1143,7 +4324,9 @@ if __name__ == "__main__":
                min_year = args.min_year,
                max_year = args.max_year,
                geometry_path = args.geojson_files,
-               prefix = args.order_name_prefix)
+               prefix = args.order_name_prefix,
+               orders = order_index(args.cache_dir),
+               full_sync = args.full_sync)
         
         
         print("\n\nUse the following download command to download the files for successful orders listed above:")
@@ -1170,7 +4353,17 @@ if __name__ == "__main__":
                max_year = args.max_year,
                geometry_path = args.geojson_files,
                output_dir = args.output_dir,
-               prefix = args.order_name_prefix)
+               prefix = args.order_name_prefix,
+               workers = args.workers,
+               resume = args.resume,
+               orders = order_index(args.cache_dir),
+               full_sync = args.full_sync,
+               selection = file_selection(args.include, args.exclude),
+               dry_run = args.dry_run,
+               postprocess = args.postprocess,
+               store = asset_store(args.store) if args.store != None else None,
+               scheduler = download_scheduler(args.max_rate * 1e6 if args.max_rate != None else None, args.host_connections),
+               priority = args.priority)
         
         
         arg_name = "-name {} ".format(args.order_name) if args.order_name != None else ""
@@ -1180,9 +4373,43 @@ if __name__ == "__main__":
         arg_gjson = "-gjson {} ".format(args.geojson_files) if args.geojson_files != None else ""
         arg_prefix = "-prefix {} ".format(args.order_name_prefix) if args.order_name_prefix != None else ""
         arg_output = "{} ".format(args.output_dir) if args.output_dir != None else ""
+        arg_resume = "--resume " if args.resume == True else ""
+        arg_select = "".join(["--include '{}' ".format(x) for x in args.include or []] + ["--exclude '{}' ".format(x) for x in args.exclude or []])
+        arg_select += "--postprocess {} ".format(args.postprocess) if args.postprocess != None else ""
+        arg_select += "--store {} ".format(args.store) if args.store != None else ""
+        arg_select += "--max_rate {} ".format(args.max_rate) if args.max_rate != None else ""
+        arg_select += "--host_connections {} ".format(args.host_connections) if args.host_connections != None else ""
+        arg_select += "--priority {} ".format(args.priority) if args.priority != "order" else ""
+        
+        if args.dry_run == False:
+            print("\nNOTE: To try downloading again, run the command below:")
+            print("python {} download {}{}{}{}{}{}{}{} {}".format(os.path.basename(__file__), arg_name, arg_date, arg_min_year, arg_max_year, arg_prefix, arg_gjson, arg_resume, arg_select, arg_output))
         
-        print("\nNOTE: To try downloading again, run the command below:")
-        print("python {} download {}{}{}{}{}{} {}".format(os.path.basename(__file__), arg_name, arg_date, arg_min_year, arg_max_year, arg_prefix, arg_gjson, arg_output))
+        
+    elif args.command == "watch":
+        
+        if(args.geojson_files != None and (args.min_year == None or args.max_year == None)):
+            raise Exception("When using -gjson, --geojson_files flag, you need to also specify -min_y, --min_year and -max_y, --max_year.")
+            
+            
+        watch(order_url=orders_url, 
+              order_name_search=args.order_name, 
+              order_date_search=args.order_date,
+              min_year = args.min_year,
+              max_year = args.max_year,
+              geometry_path = args.geojson_files,
+              output_dir = args.output_dir,
+              prefix = args.order_name_prefix,
+              workers = args.workers,
+              resume = args.resume,
+              orders = order_index(args.cache_dir),
+              min_interval = args.min_interval,
+              max_interval = args.max_interval,
+              selection = file_selection(args.include, args.exclude),
+              postprocess = args.postprocess,
+              store = asset_store(args.store) if args.store != None else None,
+              scheduler = download_scheduler(args.max_rate * 1e6 if args.max_rate != None else None, args.host_connections),
+              priority = args.priority)
         
         
     else:
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers of the tests: psites is imported from the repository root, and HTTP 
+requests are answered by a fake client instead of the Planet servers.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class fake_response:
+    """
+    Minimal stand-in for a requests.Response, streamed or not.
+    """
+
+    def __init__(self, status_code=200, body=b"", headers=None, json_data=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers if headers != None else {}
+        self.json_data = json_data
+        self.text = body.decode(errors="replace")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def json(self):
+        if self.json_data == None:
+            raise ValueError("No JSON body")
+
+        return self.json_data
+
+
+class fake_client:
+    """
+    Answers each GET with handler(url, headers), and records the requests made.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append((url, dict(headers or {})))
+        return self.handler(url, headers or {})
+
+
+class null_progress:
+    """
+    download_progress that prints nothing.
+    """
+
+    def start(self, name, size, offset=0):
+        pass
+
+    def update(self, name, nbytes):
+        pass
+
+    def finish(self, name, success):
+        pass
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cache of the item type and asset type definitions.
+"""
+
+import os
+
+import psites
+from psites import get_definitions
+
+from conftest import fake_client, fake_response
+
+
+def catalog_client():
+    return fake_client(lambda url, headers: fake_response(200, json_data={"item_types": [{"id": "PSScene", "display_name": "PlanetScope"}]}))
+
+
+def test_definitions_cached_in_directory(tmp_path, monkeypatch):
+    client = catalog_client()
+    monkeypatch.setattr(psites, "get_client", lambda: client)
+    monkeypatch.setattr(psites, "definitions", {})
+
+    assert list(get_definitions("item-types", str(tmp_path))) == ["PSScene"]
+    assert os.path.isfile(str(tmp_path / "item-types.json"))
+
+    # A new process reads the cached catalog instead of asking Planet
+    monkeypatch.setattr(psites, "definitions", {})
+
+    assert list(get_definitions("item-types", str(tmp_path))) == ["PSScene"]
+    assert len(client.requests) == 1
+
+
+def test_definitions_without_cache(tmp_path, monkeypatch):
+    client = catalog_client()
+    monkeypatch.setattr(psites, "get_client", lambda: client)
+    monkeypatch.setattr(psites, "definitions", {})
+    monkeypatch.chdir(tmp_path)
+
+    assert list(get_definitions("item-types", None)) == ["PSScene"]
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the downloads: verification of the size and digest, resuming partial downloads 
+with Range requests, and the selection of the files to download.
+"""
+
+import base64
+import hashlib
+import os
+
+import requests
+
+import psites
+from psites import download_file, download_journal, remote_size, file_selection, format_size, asset_store, download_scheduler, order_links
+
+from conftest import fake_client, fake_response, null_progress
+
+
+data = bytes(range(256)) * 40
+
+
+def md5(body):
+    return base64.b64encode(hashlib.md5(body).digest()).decode()
+
+
+def server(body, digest=None):
+    # Storage server honouring Range requests
+    def handler(url, headers):
+        digest_header = {"x-goog-hash": "crc32c=AAAA==,md5=" + (digest or md5(body))}
+        
+        if "Range" not in headers:
+            return fake_response(200, body, dict(digest_header, **{"Content-Length": str(len(body))}))
+
+        start = int(headers["Range"].split("=")[1].split("-")[0])
+
+        if start >= len(body):
+            return fake_response(416)
+
+        return fake_response(206, body[start:], dict(digest_header, **{"Content-Range": "bytes {}-{}/{}".format(start, len(body) - 1, len(body))}))
+
+    return fake_client(handler)
+
+
+def test_download_verified(tmp_path):
+    dest = str(tmp_path / "item.tif")
+
+    assert download_file(server(data), "url", dest, null_progress(), chunk_size=1000) == None
+
+    with open(dest, "rb") as file:
+        assert file.read() == data
+
+    assert os.path.exists(dest + ".part") == False
+
+
+def test_download_bad_digest(tmp_path):
+    dest = str(tmp_path / "item.tif")
+
+    failed = download_file(server(data, digest=md5(b"other")), "url", dest, null_progress())
+
+    assert failed["filename"] == "item.tif"
+    assert os.path.exists(dest) == False
+    assert os.path.exists(dest + ".part") == False
+
+
+def test_download_error_status(tmp_path):
+    dest = str(tmp_path / "item.tif")
+    client = fake_client(lambda url, headers: fake_response(404, b"not found"))
+
+    failed = download_file(client, "url", dest, null_progress())
+
+    assert failed["status_code"] == 404
+    assert failed["message"] == "not found"
+    assert os.path.exists(dest) == False
+
+
+def test_resume_with_range(tmp_path):
+    dest = str(tmp_path / "item.tif")
+    journal = download_journal(str(tmp_path))
+    journal.record("item.tif", size=len(data), md5=md5(data), committed=False)
+
+    with open(dest + ".part", "wb") as file:
+        file.write(data[:3000])
+
+    client = server(data)
+
+    assert download_file(client, "url", dest, null_progress(), journal) == None
+    assert client.requests[0][1]["Range"] == "bytes=3000-"
+
+    with open(dest, "rb") as file:
+        assert file.read() == data
+
+    assert journal.get("item.tif")["committed"] == True
+    assert journal.is_complete("item.tif", dest)
+
+
+def test_resume_complete_part_file(tmp_path):
+    # The partial file already holds every byte, the server answers 416
+    dest = str(tmp_path / "item.tif")
+    journal = download_journal(str(tmp_path))
+    journal.record("item.tif", size=len(data), md5=md5(data), committed=False)
+
+    with open(dest + ".part", "wb") as file:
+        file.write(data)
+
+    assert download_file(server(data), "url", dest, null_progress(), journal) == None
+    assert os.path.exists(dest) and os.path.exists(dest + ".part") == False
+
+
+def test_resume_corrupt_part_file(tmp_path):
+    dest = str(tmp_path / "item.tif")
+    journal = download_journal(str(tmp_path))
+    journal.record("item.tif", size=len(data), md5=md5(data), committed=False)
+
+    with open(dest + ".part", "wb") as file:
+        file.write(b"x" * 3000)
+
+    failed = download_file(server(data), "url", dest, null_progress(), journal)
+
+    assert failed != None
+    assert os.path.exists(dest) == False
+    assert journal.get("item.tif") == None
+
+
+def test_resume_file_changed_on_server(tmp_path):
+    # The journaled size no longer matches, the download starts over
+    dest = str(tmp_path / "item.tif")
+    journal = download_journal(str(tmp_path))
+    journal.record("item.tif", size=len(data) + 10, md5=md5(data), committed=False)
+
+    with open(dest + ".part", "wb") as file:
+        file.write(data[:3000])
+
+    client = server(data)
+
+    assert download_file(client, "url", dest, null_progress(), journal) == None
+    assert [x[1].get("Range") for x in client.requests] == ["bytes=3000-", None]
+
+    with open(dest, "rb") as file:
+        assert file.read() == data
+
+
+def test_journal_appends_changes(tmp_path):
+    journal = download_journal(str(tmp_path))
+    journal.record("a.tif", size=10, md5="x", committed=False)
+    journal.record("b.tif", size=20, md5="y", committed=False)
+    journal.record("a.tif", committed=True)
+    journal.remove("b.tif")
+
+    # One line per change, the earlier lines are never rewritten
+    with open(journal.path) as file:
+        assert len(file.readlines()) == 4
+
+    journal = download_journal(str(tmp_path))
+
+    assert journal.get("a.tif") == {"size": 10, "md5": "x", "committed": True}
+    assert journal.get("b.tif") == None
+
+
+def test_resume_unknown_total_size(tmp_path):
+    # Content-Range without the total size, the file is verified by its digest only
+    dest = str(tmp_path / "item.tif")
+    journal = download_journal(str(tmp_path))
+    journal.record("item.tif", size=None, md5=md5(data), committed=False)
+
+    with open(dest + ".part", "wb") as file:
+        file.write(data[:3000])
+
+    client = fake_client(lambda url, headers: fake_response(206, data[3000:], {"Content-Range": "bytes 3000-{}/*".format(len(data) - 1),
+                                                                               "Content-MD5": md5(data)}))
+
+    assert download_file(client, "url", dest, null_progress(), journal) == None
+
+    with open(dest, "rb") as file:
+        assert file.read() == data
+
+
+def test_download_malformed_size(tmp_path):
+    dest = str(tmp_path / "item.tif")
+    client = fake_client(lambda url, headers: fake_response(200, data, {"Content-Length": "many"}))
+
+    failed = download_file(client, "url", dest, null_progress())
+
+    assert failed["filename"] == "item.tif" and failed["status_code"] == None
+    assert os.path.exists(dest) == False
+
+
+def test_remote_size(monkeypatch):
+    client = server(data)
+    monkeypatch.setattr(psites, "get_client", lambda: client)
+
+    # Only the first byte is requested
+    assert remote_size("url") == len(data)
+    assert client.requests[0][1]["Range"] == "bytes=0-0"
+
+    answers = {"ignored": fake_response(200, data, {"content-length": str(len(data))}),
+               "unknown": fake_response(206, data[:1], {"Content-Range": "bytes 0-0/*"}),
+               "missing": fake_response(404)}
+    monkeypatch.setattr(psites, "get_client", lambda: fake_client(lambda url, headers: answers[url]))
+
+    assert remote_size("ignored") == len(data)
+    assert remote_size("unknown") == None
+    assert remote_size("missing") == None
+
+
+def test_remote_size_connection_error(monkeypatch):
+    def handler(url, headers):
+        raise requests.exceptions.ConnectionError("Connection refused")
+
+    monkeypatch.setattr(psites, "get_client", lambda: fake_client(handler))
+
+    assert remote_size("url") == None
+
+
+def test_file_selection():
+    everything = file_selection()
+    analytic = file_selection(include=["*_AnalyticMS_SR*.tif", "*.xml"], exclude=["*_clip*"])
+
+    assert everything.selected("a_udm2.tif")
+    assert analytic.selected("a_3B_AnalyticMS_SR.tif")
+    assert analytic.selected("a_metadata.xml")
+    assert analytic.selected("a_3B_AnalyticMS_SR_clip.tif") == False
+    assert analytic.selected("a_udm2.tif") == False
+    assert file_selection(exclude=["*udm*"]).selected("a_udm2.tif") == False
+
+
+def test_format_size():
+    assert format_size(512) == "512.0 B"
+    assert format_size(1500000) == "1.5 MB"
+    assert format_size(2.5e12) == "2.5 TB"
+
+
+def test_asset_store_links_stored_files(tmp_path):
+    store = asset_store(str(tmp_path / "store"))
+    key = ("item", "ortho_analytic_4b", "0123abcd", len(data))
+    first = tmp_path / "site_a" / "item.tif"
+    first.parent.mkdir()
+    first.write_bytes(data)
+
+    assert store.lookup(key) == None
+
+    store.add(str(first), key)
+    stored = store.lookup(key)
+
+    # Another order finds the file in the store and links it, even after a restart
+    assert stored == asset_store(str(tmp_path / "store")).lookup(key)
+
+    second = str(tmp_path / "site_b" / "item.tif")
+
+    assert store.link(stored, second)
+    assert os.path.samefile(second, str(first))
+    assert os.path.exists(second + ".part") == False
+
+
+def test_asset_store_lookup_checks_the_file(tmp_path):
+    store = asset_store(str(tmp_path / "store"))
+    key = ("item", "ortho_analytic_4b", "0123abcd", len(data))
+    path = tmp_path / "item.tif"
+    path.write_bytes(data)
+    store.add(str(path), key)
+
+    # Another digest or size is another file
+    assert store.lookup(("item", "ortho_analytic_4b", "ffff", len(data))) == None
+    assert store.lookup(key[:3] + (len(data) + 1,)) == None
+    assert store.lookup(key[:3] + (None,)) != None
+
+    os.remove(store.lookup(key))
+
+    assert store.lookup(key) == None
+
+
+def test_scheduler_priorities():
+    # (order number, index in the order, size)
+    files = [(0, 0, 30), (0, 1, 10), (1, 0, 20), (1, 1, None), (2, 0, 5)]
+    scheduler = download_scheduler()
+
+    assert scheduler.queue(files, "order") == files
+    assert scheduler.queue(files, "round_robin") == [(0, 0, 30), (1, 0, 20), (2, 0, 5), (0, 1, 10), (1, 1, None)]
+    assert scheduler.queue(files, "smallest") == [(2, 0, 5), (0, 1, 10), (1, 0, 20), (0, 0, 30), (1, 1, None)]
+
+
+def test_scheduler_throttle(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(psites.time, "monotonic", lambda: 100.0)
+    monkeypatch.setattr(psites.time, "sleep", sleeps.append)
+    scheduler = download_scheduler(max_rate=1000)
+
+    # An idle link bursts for up to one second, then each chunk waits for its share
+    for x in range(4):
+        scheduler.throttle(500)
+
+    assert sleeps == [0.5, 1.0]
+
+    download_scheduler().throttle(10 ** 9)
+
+    assert sleeps == [0.5, 1.0]
+
+
+def test_scheduler_host_connections():
+    scheduler = download_scheduler(host_connections=2)
+    host = scheduler.connection("https://storage.example.com/a")
+
+    assert scheduler.connection("https://storage.example.com/b") is host
+    assert scheduler.connection("https://other.example.com/a") is not host
+    assert host.acquire(blocking=False) and host.acquire(blocking=False)
+    assert host.acquire(blocking=False) == False
+
+
+def order_response(version, expires_at=None):
+    return {"_links": {"results": [{"name": "order/{}".format(x), "location": "{}?v={}".format(x, version), "expires_at": expires_at}
+                                   for x in ["a.tif", "b.tif"]]}}
+
+
+def test_order_links_refresh_once(monkeypatch):
+    versions = iter(range(2, 10))
+    client = fake_client(lambda url, headers: fake_response(200, json_data=order_response(next(versions))))
+    monkeypatch.setattr(psites, "get_client", lambda: client)
+    links = order_links("orders/1", order_response(1))
+
+    assert links.location("a.tif") == "a.tif?v=1"
+    assert links.refresh("a.tif", "a.tif?v=1") == "a.tif?v=2"
+
+    # The order was already retrieved again since b.tif got its stale location
+    assert links.refresh("b.tif", "b.tif?v=1") == "b.tif?v=2"
+    assert [x[0] for x in client.requests] == ["orders/1"]
+
+
+def test_order_links_refresh_expired(monkeypatch):
+    answers = [fake_response(200, json_data=order_response(2, "2100-01-01T00:00:00Z")), fake_response(500)]
+    client = fake_client(lambda url, headers: answers.pop(0))
+    monkeypatch.setattr(psites, "get_client", lambda: client)
+    links = order_links("orders/1", order_response(1, "2000-01-01T00:00:00Z"))
+
+    # The location expired, the order is retrieved again before handing it out
+    assert links.location("a.tif") == "a.tif?v=2"
+    assert links.location("b.tif") == "b.tif?v=2"
+    assert len(client.requests) == 1
+
+    # A failed refresh keeps the locations known
+    assert links.refresh("a.tif", "a.tif?v=2") == "a.tif?v=2"
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the geometry helpers used by the batch and footprint searches and by the 
+chunk planner.
+"""
+
+from psites import rings_intersect, ring_contains, clip_ring, ring_bounds, z_order
+
+
+square = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+
+
+def box(min_x, min_y, max_x, max_y):
+    return [[min_x, min_y], [max_x, min_y], [max_x, max_y], [min_x, max_y], [min_x, min_y]]
+
+
+def test_rings_intersect_overlapping_and_disjoint():
+    assert rings_intersect(square, box(2, 2, 6, 6))
+    assert rings_intersect(box(2, 2, 6, 6), square)
+    assert rings_intersect(square, box(5, 5, 6, 6)) == False
+
+
+def test_rings_intersect_crossing_edges_only():
+    # No vertex of either ring lies inside the other, only their edges cross
+    assert rings_intersect(square, box(-1, 1, 5, 2))
+
+
+def test_rings_intersect_bounding_boxes_overlap_only():
+    triangle = [[0, 0], [4, 0], [0, 4], [0, 0]]
+    assert rings_intersect(triangle, box(3, 3, 5, 5)) == False
+
+
+def test_ring_contains():
+    assert ring_contains(square, box(1, 1, 2, 2))
+    assert ring_contains(square, square)
+    assert ring_contains(square, box(0, 0, 2, 2))    # Touching the boundary
+    assert ring_contains(square, box(3, 3, 5, 5)) == False
+    assert ring_contains(box(1, 1, 2, 2), square) == False
+
+
+def test_ring_contains_concave_outer():
+    # All the vertices of the inner ring are inside the L shape, but an edge cuts the notch
+    l_shape = [[0, 0], [4, 0], [4, 1], [1, 1], [1, 4], [0, 4], [0, 0]]
+    inner = [[0.5, 0.5], [3.5, 0.5], [0.5, 3.5], [0.5, 0.5]]
+    assert ring_contains(l_shape, inner) == False
+
+
+def test_clip_ring():
+    clipped = clip_ring(square, box(2, -1, 6, 2))
+
+    assert clipped[0] == clipped[-1]
+    assert ring_bounds(clipped) == (2, 0, 4, 2)
+    assert clip_ring(square, box(5, 5, 6, 6)) == []
+
+
+def test_clip_ring_inside_rectangle():
+    assert ring_bounds(clip_ring(box(1, 1, 2, 2), square)) == (1, 1, 2, 2)
+
+
+def test_z_order_quadrants():
+    bounds = (0, 0, 1, 1)
+    quadrants = [z_order(0.25, 0.25, bounds), z_order(0.75, 0.25, bounds), 
+                 z_order(0.25, 0.75, bounds), z_order(0.75, 0.75, bounds)]
+
+    assert quadrants == sorted(quadrants)
+    assert z_order(0, 0, bounds) == 0
+    assert z_order(1, 1, bounds) == (1 << 32) - 1
+
+
+def test_z_order_single_point_bounds():
+    # Every item at the same place, the span falls back to 1
+    assert z_order(3, 3, (3, 3, 3, 3)) == 0
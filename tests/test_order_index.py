@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental sync of the local order index.
+"""
+
+import psites
+from psites import order_index
+
+from conftest import fake_client, fake_response
+
+
+def order(number, state="success"):
+    return {"id": "id{:02d}".format(number), "name": "site_2016_2017_chunk_{}".format(number), "state": state,
+            "created_on": "2023-01-{:02d}T00:00:00.000000Z".format(number + 1)}
+
+
+def order_list(orders, page_size=2, failing=()):
+    # Order list served newest first in pages, the pages in failing answer 503
+    orders = sorted(orders, key=lambda x: x["created_on"], reverse=True)
+    
+    def handler(url, headers):
+        start = int(url.split("_start=")[1]) if "_start=" in url else 0
+
+        if start // page_size in failing:
+            return fake_response(503)
+
+        links = {"next": "orders?_start={}".format(start + page_size)} if start + page_size < len(orders) else {}
+        return fake_response(200, json_data={"orders": orders[start:start + page_size], "_links": links})
+
+    return fake_client(handler)
+
+
+def use(monkeypatch, client):
+    monkeypatch.setattr(psites, "get_client", lambda: client)
+    return client
+
+
+def test_sync_stops_at_known_page(tmp_path, monkeypatch):
+    monkeypatch.setenv("PL_API_KEY", "key")
+    orders = [order(x) for x in range(6)]
+    index = order_index(str(tmp_path))
+
+    use(monkeypatch, order_list(orders))
+    index.sync("orders")
+    assert index.count() == 6
+
+    client = use(monkeypatch, order_list(orders + [order(6)]))
+    index.sync("orders")
+
+    assert index.count() == 7
+    assert len(client.requests) == 2    # New page and the first page of known orders
+
+
+def test_interrupted_sync_is_completed(tmp_path, monkeypatch):
+    monkeypatch.setenv("PL_API_KEY", "key")
+    orders = [order(x) for x in range(6)]
+    index = order_index(str(tmp_path))
+
+    # The second page fails, only the newest orders are indexed
+    use(monkeypatch, order_list(orders, failing=[1]))
+    index.sync("orders")
+    assert index.count() == 2
+
+    # The first page holds only known orders, but the older pages were never retrieved
+    client = use(monkeypatch, order_list(orders))
+    index.sync("orders")
+    assert index.count() == 6
+    assert len(client.requests) == 3
+
+    client = use(monkeypatch, order_list(orders))
+    index.sync("orders")
+    assert len(client.requests) == 1
+
+
+def test_sync_refreshes_running_orders(tmp_path, monkeypatch):
+    monkeypatch.setenv("PL_API_KEY", "key")
+    index = order_index(str(tmp_path))
+
+    use(monkeypatch, order_list([order(0, "running")] + [order(x) for x in range(1, 4)]))
+    index.sync("orders")
+
+    # The sync stops before the page of the running order, which is retrieved on its own
+    def handler(url, headers):
+        if url == "orders/id00":
+            return fake_response(200, json_data=order(0, "success"))
+
+        return order_list([order(0, "running")] + [order(x) for x in range(1, 6)]).handler(url, headers)
+
+    client = use(monkeypatch, fake_client(handler))
+    index.sync("orders")
+
+    assert [x[0] for x in client.requests] == ["orders", "orders?_start=2", "orders/id00"]
+    assert index.query(states=["running"]) == []
+    assert index.count() == 6
+
+
+def test_index_per_account(tmp_path, monkeypatch):
+    use(monkeypatch, order_list([order(x) for x in range(3)]))
+
+    monkeypatch.setenv("PL_API_KEY", "first")
+    order_index(str(tmp_path)).sync("orders")
+
+    monkeypatch.setenv("PL_API_KEY", "second")
+    index = order_index(str(tmp_path))
+
+    assert index.count() == 0
+    assert index.query(name_search="site*") == []
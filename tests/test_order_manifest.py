@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the order manifest and of the resubmission of the chunks it records.
+"""
+
+import json
+
+import psites
+from psites import aoi_order, order_manifest
+
+from conftest import fake_response
+
+
+class planned:
+    """
+    search_table stand-in returning fixed chunks.
+    """
+
+    def __init__(self, chunks):
+        self.planned = chunks
+
+    def chunks(self, chunk_items, mask=None):
+        return self.planned
+
+
+class order_poster:
+    """
+    Answers each order POST, accepting the chunks whose name is not in failing.
+    """
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.posted = []
+
+    def post(self, url, data=None, **kwargs):
+        request = json.loads(data)
+        self.posted.append((request["name"], request["products"][0]["item_ids"]))
+
+        if request["name"] in self.failing:
+            return fake_response(400, json_data={"field": "Bad request"})
+
+        return fake_response(202, json_data={"id": "id_" + request["name"]})
+
+
+def make_order(monkeypatch, manifest, chunks, poster, signature="sig"):
+    # aoi_order without the search, holding the chunks of a finished search
+    monkeypatch.setattr(psites, "get_client", lambda: poster)
+
+    site = object.__new__(aoi_order)
+    site.site_name = "site"
+    site.order_name = "site_2016_2017"
+    site.item_type = "PSScene"
+    site.bundle = "analytic_udm2"
+    site.clip = False
+    site.chunk_items = 2
+    site.item_mb = 100
+    site.signature = signature
+    site.existing_orders = {}
+    site.results = planned(chunks)
+    site.resubmit = manifest.matches(site.order_name, site.item_type, site.bundle, signature)
+    return site
+
+
+def submit(site, manifest):
+    return {name: future.result() for name, future in site.submit_order(manifest=manifest)}
+
+
+def test_manifest_replays_plan_and_results(tmp_path):
+    path = str(tmp_path / "manifest.ndjson")
+    manifest = order_manifest(path)
+    manifest.plan("site", "PSScene", "analytic_udm2", [["a", "b"], ["c"]], signature="sig")
+    manifest.record("site", "site_chunk_0", "id0", "Accepted")
+    manifest.record("site", "site_chunk_1", None, "Failed: Bad request")
+
+    # The item IDs are written once, each result is one more line
+    with open(path) as file:
+        assert len(file.readlines()) == 3
+
+    manifest = order_manifest(path)
+
+    assert manifest.matches("site", "PSScene", "analytic_udm2", "sig")
+    assert [x["item_ids"] for x in manifest.chunks("site")] == [["a", "b"], ["c"]]
+    assert manifest.chunk("site", "site_chunk_0")["order_id"] == "id0"
+    assert manifest.chunk("site", "site_chunk_1")["status"] == "failed"
+    assert manifest.failed_count() == 1
+
+
+def test_manifest_ignores_cut_line(tmp_path):
+    path = str(tmp_path / "manifest.ndjson")
+    manifest = order_manifest(path)
+    manifest.plan("site", "PSScene", "analytic_udm2", [["a"]], signature="sig")
+
+    with open(path, "a") as file:
+        file.write('{"order": "site", "chunk": "site_ch')
+
+    assert order_manifest(path).chunk("site", "site_chunk_0")["status"] == "pending"
+
+
+def test_resubmits_failed_chunks_with_same_items(tmp_path, monkeypatch):
+    path = str(tmp_path / "manifest.ndjson")
+    manifest = order_manifest(path)
+    first = order_poster(failing=["site_2016_2017_chunk_1"])
+    submit(make_order(monkeypatch, manifest, [["a", "b"], ["c", "d"]], first), manifest)
+
+    assert manifest.failed_count() == 1
+
+    # The next search finds other items, the failed chunk is resubmitted as planned
+    manifest = order_manifest(path)
+    second = order_poster()
+    results = submit(make_order(monkeypatch, manifest, [["x"]], second), manifest)
+
+    assert second.posted == [("site_2016_2017_chunk_1", ["c", "d"])]
+    assert results["site_2016_2017_chunk_0"] == ("id_site_2016_2017_chunk_0", "Accepted (previously submitted)")
+    assert order_manifest(path).failed_count() == 0
+
+
+def test_changed_settings_plan_the_order_again(tmp_path, monkeypatch):
+    path = str(tmp_path / "manifest.ndjson")
+    manifest = order_manifest(path)
+    submit(make_order(monkeypatch, manifest, [["a"]], order_poster()), manifest)
+
+    manifest = order_manifest(path)
+    poster = order_poster()
+    site = make_order(monkeypatch, manifest, [["x"]], poster, signature="other")
+
+    assert site.resubmit == False
+
+    submit(site, manifest)
+
+    assert poster.posted == [("site_2016_2017_chunk_0", ["x"])]
+    assert order_manifest(path).chunks("site_2016_2017")[0]["item_ids"] == ["x"]
+
+
+def test_later_batches_are_deferred(tmp_path, monkeypatch):
+    monkeypatch.setattr(psites, "order_max_chunks", 3)
+    path = str(tmp_path / "manifest.ndjson")
+    manifest = order_manifest(path)
+    first = order_poster()
+    submit(make_order(monkeypatch, manifest, [["a"], ["b"], ["c"]], first), manifest)
+
+    # Batches of order_max_chunks - 1 chunks, only the first one is submitted
+    assert [x[0] for x in first.posted] == ["site_2016_2017_chunk_0", "site_2016_2017_chunk_1"]
+    assert manifest.deferred_count() == 1
+    assert manifest.failed_count() == 0
+
+    manifest = order_manifest(path)
+    second = order_poster()
+    submit(make_order(monkeypatch, manifest, [["a"], ["b"], ["c"]], second), manifest)
+
+    assert second.posted == [("site_2016_2017_chunk_2", ["c"])]
+    assert order_manifest(path).deferred_count() == 0
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the searches of a site: tiled searches and the caching of search results.
+"""
+
+import json
+import os
+import threading
+import time
+
+import psites
+from psites import aoi, search_cache, search_history
+
+from test_search_table import feature
+
+
+l_shape = [[0, 0], [4, 0], [4, 1], [1, 1], [1, 4], [0, 4], [0, 0]]
+
+
+def make_site(tmp_path, ring=l_shape):
+    path = tmp_path / "site.geojson"
+    path.write_text(json.dumps({"type": "FeatureCollection", 
+                                "features": [{"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}}]}))
+    return aoi(str(path), 2016, 2017)
+
+
+def fake_search(site, pages_of):
+    # Replaces the quick search of the site, answering pages_of(filter) for each search
+    searches = []
+    running = [0, 0]    # Searches running, most searches running at the same time
+    lock = threading.Lock()
+
+    def quick_search(quick_url, item_types, api_filter, show_progress=True, geometry=None):
+        with lock:
+            searches.append(api_filter)
+            running[0] += 1
+            running[1] = max(running)
+
+        time.sleep(0.01)
+
+        with lock:
+            running[0] -= 1
+
+        for page in pages_of(api_filter):
+            yield page
+
+    site.__quick_search__ = quick_search
+    return searches, running
+
+
+def cell_filter(api_filter):
+    return [x for x in api_filter["config"] if x["type"] == "GeometryFilter"][0]
+
+
+def test_tiles_outside_aoi_not_searched(tmp_path):
+    site = make_site(tmp_path)
+    searches, running = fake_search(site, lambda api_filter: [[feature(json.dumps(cell_filter(api_filter)), "2016-01-01T00:00:00Z")]])
+
+    site.item_search(tiles=2)
+
+    # The top right tile of the bounding box is outside the L shaped AOI
+    cells = [cell_filter(x)["config"]["coordinates"][0] for x in searches]
+
+    assert len(cells) == 3
+    assert [[2, 2], [4, 2], [4, 4], [2, 4], [2, 2]] not in cells
+    assert len(site.results) == 3
+
+
+def test_part_workers(tmp_path):
+    site = make_site(tmp_path)
+    searches, running = fake_search(site, lambda api_filter: [])
+
+    site.item_search(tiles=2, part_workers=1)
+
+    assert len(searches) == 3
+    assert running[1] == 1
+
+
+def test_search_cache_reused_until_expired(tmp_path):
+    cache = search_cache(str(tmp_path / "cache"), ttl=1)
+    site = make_site(tmp_path)
+    searches, running = fake_search(site, lambda api_filter: [[feature("a", "2016-01-01T00:00:00Z"), feature("b", "2016-02-01T00:00:00Z")]])
+
+    site.item_search(cache=cache)
+    site.item_search(cache=cache)
+
+    assert len(searches) == 1
+    assert site.results.ids() == ["a", "b"]
+
+    # Results older than the TTL are searched again
+    for name in os.listdir(cache.path):
+        os.utime(os.path.join(cache.path, name), (time.time(), time.time() - 7200))
+
+    site.item_search(cache=cache)
+
+    assert len(searches) == 2
+
+
+def test_search_cache_evicts_least_recently_used(tmp_path):
+    cache = search_cache(str(tmp_path), ttl=1, max_mb=0.0025)
+    now = time.time()
+
+    # Three results of 1000 bytes, used at different times, and an expired one
+    for name, atime, mtime in [("old", now - 30, now), ("recent", now - 10, now), ("newest", now, now), ("expired", now, now - 7200)]:
+        path = os.path.join(cache.path, name + ".ndjson")
+
+        with open(path, "w") as file:
+            file.write("x" * 1000)
+
+        os.utime(path, (atime, mtime))
+
+    cache.evict()
+
+    assert sorted(os.listdir(cache.path)) == ["newest.ndjson", "recent.ndjson"]
+
+
+def published(item_id, date, cloud=0.1):
+    item = feature(item_id, "2016-01-01T00:00:00Z")
+    item["properties"].update({"published": date, "cloud_cover": cloud})
+    return item
+
+
+def test_incremental_search_merges_new_items(tmp_path):
+    history = search_history(str(tmp_path / "cache"))
+    site = make_site(tmp_path)
+    searches, running = fake_search(site, lambda api_filter: [[published("a", "2016-01-02T00:00:00Z"), published("b", "2016-01-03T00:00:00Z")]])
+
+    site.item_search(history=history)
+
+    # Only the items published since the last search are asked for, an updated item 
+    # replaces the stored one
+    searches, running = fake_search(site, lambda api_filter: [[published("b", "2016-01-05T00:00:00Z", cloud=0.2), published("c", "2016-01-04T00:00:00Z")]])
+
+    site.item_search(history=history)
+
+    assert {"type": "DateRangeFilter", "field_name": "published", "config": {"gte": "2016-01-03T00:00:00Z"}} in searches[0]["config"]
+    assert sorted(site.results.ids()) == ["a", "b", "c"]
+
+    record = history.load(site.aoi_feature, psites.default_item_type, site.api_filter)
+    features = {x["id"]: x for x in record["features"]}
+
+    assert record["high_water"] == "2016-01-05T00:00:00Z"
+    assert features["b"]["properties"]["cloud_cover"] == 0.2
+    assert len(features) == 3
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the columnar search_table and of the parsing of Planet timestamps.
+"""
+
+from datetime import datetime as dt
+from datetime import timezone
+
+from psites import search_table, parse_timestamp, date_format
+
+
+def feature(item_id, acquired, item_type="PSScene", assets=("ortho_analytic_4b",), x=0):
+    return {"id": item_id,
+            "geometry": {"type": "Polygon", "coordinates": [[[x, 0], [x + 1, 0], [x + 1, 1], [x, 1], [x, 0]]]},
+            "properties": {"acquired": acquired, "item_type": item_type},
+            "assets": list(assets),
+            "_permissions": ["assets.{}:download".format(x) for x in assets]}
+
+
+def make_table():
+    table = search_table()
+    table.append(feature("a", "2016-03-01T10:00:00.000000Z", assets=("ortho_analytic_4b", "ortho_udm2")))
+    table.append(feature("b", "2016-07-01T10:00:00Z"))
+    table.append(feature("c", "2017-01-05T10:00:00.5Z", item_type="SkySatScene", assets=("ortho_visual",)))
+    table.append(feature("d", "2017-02-05T10:00:00.000Z", assets=("ortho_udm2",)))
+    return table
+
+
+def test_parse_timestamp_matches_strptime():
+    text = "2016-07-11T11:05:31.123456Z"
+    assert parse_timestamp(text) == dt.strptime(text, date_format).replace(tzinfo=timezone.utc)
+
+
+def test_parse_timestamp_variants():
+    assert parse_timestamp("2016-07-11T11:05:31Z") == dt(2016, 7, 11, 11, 5, 31, tzinfo=timezone.utc)
+    assert parse_timestamp("2016-07-11T11:05:31.5Z").microsecond == 500000
+    assert parse_timestamp("2016-07-11T11:05:31.123Z").microsecond == 123000
+    assert parse_timestamp("2016-07-11T11:05:31.123456789Z").microsecond == 123456
+    assert parse_timestamp("2016-07-11T13:05:31+02:00") == dt(2016, 7, 11, 11, 5, 31, tzinfo=timezone.utc)
+    assert parse_timestamp("2016-07-11T11:05:31").tzinfo == timezone.utc
+
+
+def test_masks():
+    table = make_table()
+
+    assert len(table) == 4
+    assert table.ids(table.mask()) == ["a", "b", "c", "d"]
+    assert table.ids(table.mask(year=2016)) == ["a", "b"]
+    assert table.ids(table.mask(year="2017", item_type="PSScene")) == ["d"]
+    assert table.ids(table.mask(asset="ortho_udm2")) == ["a", "d"]
+    assert table.mask(item_type="REOrthoTile") == 0
+    assert table.mask(asset="basic_analytic") == 0
+    assert table.mask(year=2020) == 0
+
+
+def test_summary_and_permissions():
+    table = make_table()
+
+    assert table.summary() == {"2016": {"PSScene": {"item_count": 2, "assets_tracker": {"ortho_analytic_4b": 2, "ortho_udm2": 1}}},
+                               "2017": {"PSScene": {"item_count": 1, "assets_tracker": {"ortho_udm2": 1}},
+                                        "SkySatScene": {"item_count": 1, "assets_tracker": {"ortho_visual": 1}}}}
+    assert table.permissions == {"ortho_analytic_4b", "ortho_udm2", "ortho_visual"}
+
+
+def test_bitsets_past_one_byte():
+    table = search_table()
+
+    for x in range(20):
+        table.append(feature("id{}".format(x), "2016-01-01T00:00:00Z" if x % 3 else "2017-01-01T00:00:00Z"))
+
+    assert table.ids(table.mask(year=2017)) == ["id{}".format(x) for x in range(0, 20, 3)]
+    assert table.rows(table.mask(year=2016)) == [x for x in range(20) if x % 3]
+
+
+def test_chunks_are_balanced_and_complete():
+    table = search_table()
+
+    for x in range(10):
+        table.append(feature("id{}".format(x), "2016-01-0{}T00:00:00Z".format(x % 3 + 1), x=x))
+
+    chunks = table.chunks(4)
+
+    assert [len(x) for x in chunks] == [3, 3, 4]
+    assert sorted(sum(chunks, [])) == sorted(table.ids())
+    assert table.chunks(4, mask=0) == []
+
+
+def test_chunks_group_by_day_then_place():
+    table = search_table()
+
+    # Pages of a split search arrive out of order
+    for x in [5, 0, 7, 2, 6, 1, 4, 3]:
+        table.append(feature("id{}".format(x), "2016-01-0{}T00:00:00Z".format(x // 4 + 1), x=x))
+
+    assert table.chunks(4) == [["id0", "id1", "id2", "id3"], ["id4", "id5", "id6", "id7"]]
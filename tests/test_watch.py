@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the watch command: polling the orders being processed and downloading each 
+order once it is ready.
+"""
+
+import os
+
+import psites
+from psites import watch
+
+from conftest import fake_client, fake_response
+
+
+class stub_index:
+    """
+    order_index holding a fixed order list.
+    """
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.updated = []
+
+    def synced(self, order_url=None, full=False):
+        return self
+
+    def query(self, name_search=None, date_search=None, const_oname_list=None, states=None):
+        return self.orders
+
+    def update(self, orders):
+        self.updated.extend(orders)
+
+
+def order(name, state):
+    return {"id": "id_" + name, "name": name, "state": state, "last_message": "Done", 
+            "created_on": "2023-01-01T00:00:00.000000Z", "_links": {"_self": "orders/" + name}}
+
+
+def setup(monkeypatch, states):
+    # Each poll of an order answers the next of its states
+    downloads = []
+    sleeps = []
+
+    def handler(url, headers):
+        name = url.split("/")[-1]
+        return fake_response(200, json_data=order(name, states[name].pop(0)))
+
+    def get_data(order_list, output_dir, *args, **kwargs):
+        downloads.append((order_list[0]["name"], output_dir))
+        return {}
+
+    monkeypatch.setattr(psites, "check_base_server", lambda: None)
+    monkeypatch.setattr(psites, "get_client", lambda: fake_client(handler))
+    monkeypatch.setattr(psites, "get_data", get_data)
+    monkeypatch.setattr(psites, "print_download_summary", lambda summary, dest: None)
+    monkeypatch.setattr(psites.time, "sleep", sleeps.append)
+    return downloads, sleeps
+
+
+def test_downloads_orders_as_they_are_ready(monkeypatch):
+    downloads, sleeps = setup(monkeypatch, {"a_chunk_0": ["running", "running", "success"], 
+                                            "b_chunk_0": ["queued", "failed"]})
+    orders = stub_index([order("a_chunk_0", "running"), order("b_chunk_0", "queued"), order("c_chunk_0", "success")])
+
+    watch("out", orders=orders, min_interval=1, max_interval=10)
+
+    assert downloads == [("c_chunk_0", "out"), ("a_chunk_0", "out")]
+    # Back off while nothing changes, poll again soon after a change
+    assert sleeps == [1, 1.5, 1]
+    assert [x["state"] for x in orders.updated] == ["running", "queued", "running", "failed", "success"]
+
+
+def test_keeps_polling_after_error_status(monkeypatch):
+    downloads, sleeps = setup(monkeypatch, {"a_chunk_0": ["success"]})
+    answers = [fake_response(503), fake_response(200, json_data=order("a_chunk_0", "success"))]
+    monkeypatch.setattr(psites, "get_client", lambda: fake_client(lambda url, headers: answers.pop(0)))
+
+    watch("out", orders=stub_index([order("a_chunk_0", "running")]), min_interval=1, max_interval=10)
+
+    assert downloads == [("a_chunk_0", "out")]
+    assert len(sleeps) == 2
+
+
+def test_selects_the_orders_of_each_site(tmp_path, monkeypatch):
+    sites = tmp_path / "sites"
+    sites.mkdir()
+    (sites / "A.geojson").write_text("{}")
+    downloads, sleeps = setup(monkeypatch, {"A_2016_2017_chunk_0": ["success"]})
+    
+    # Order of another site whose name starts with the order name of site A
+    orders = stub_index([order("A_2016_2017_chunk_0", "running"), order("A_2016_2017_v2_chunk_0", "success")])
+
+    watch(str(tmp_path), orders=orders, min_year=2016, max_year=2017, geometry_path=str(sites), min_interval=1, max_interval=10)
+
+    assert downloads == [("A_2016_2017_chunk_0", os.path.join(str(tmp_path), "A", "A_2016_2017"))]